@@ -0,0 +1,155 @@
+"""
+Admission control for the raster path
+
+Every raster render holds full-size raster buffers, so a burst of raster jobs
+can run the machine out of memory. Two limits keep that predictable:
+
+RenderGate caps how many renders (poppler processes, PDFium renders) run at
+once. Its slots are lock files in a shared directory held with flock, so every
+thread of every process pointing at the same directory (web workers, the user's
+other apps and batches) draws from the same slots, and a slot held by a process
+that dies is freed by the kernel. The default directory is per user and created
+0700, since every process taking a slot must be able to open its lock file. A render that could use several poppler threads
+waits for one slot, then takes as many more as are free right away and renders
+with that many.
+
+MemoryBudget admits a job's raster stage only once its estimated pixel memory
+fits in what the other jobs of this process have left of the budget. A job
+estimated above the whole budget is admitted alone.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from engine import user_cache_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows: slots are only shared by the threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Shared by every process of the current user unless told otherwise
+DEFAULT_LOCK_DIR = user_cache_dir('pdf_render_slots')
+DEFAULT_SLOTS = os.cpu_count() or 1
+
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# While every slot is taken, waiters poll this often (seconds, backing off to the maximum)
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.2
+
+
+class AdmissionError(RuntimeError):
+    """A job could not be admitted within its timeout"""
+
+
+class RenderGate:
+    """At most ``slots`` renders at once, across every process sharing ``directory``
+
+    Instances are cheap and picklable, so render workers get their own copy of
+    the same gate.
+    """
+
+    def __init__(self, slots=DEFAULT_SLOTS, directory=DEFAULT_LOCK_DIR):
+        self.slots = max(1, slots)
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._init_local()
+
+    def _init_local(self):
+        # Without flock, a semaphore stands in for the lock files
+        self._semaphore = threading.BoundedSemaphore(self.slots) if fcntl is None else None
+        # Where the next search for a free slot starts, so callers don't all contend for slot 0
+        self._start = itertools.count()
+
+    def __getstate__(self):
+        return {'slots': self.slots, 'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    @contextmanager
+    def hold(self, wanted=1):
+        """Hold between 1 and ``wanted`` slots for a render; yields how many were granted"""
+        start = time.perf_counter()
+        held = [self._acquire()]
+        metrics.RENDER_SLOT_WAIT_SECONDS.observe(time.perf_counter() - start)
+        try:
+            while len(held) < min(wanted, self.slots):
+                slot = self._try_acquire()
+                if slot is None:
+                    break
+                held.append(slot)
+            yield len(held)
+        finally:
+            for slot in held:
+                self._release(slot)
+
+    def _acquire(self):
+        delay = POLL_INTERVAL
+        while True:
+            slot = self._try_acquire()
+            if slot is not None:
+                return slot
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_POLL_INTERVAL)
+
+    def _try_acquire(self):
+        """Take any free slot without waiting; return its handle, or None if all are taken"""
+        if fcntl is None:
+            return True if self._semaphore.acquire(blocking=False) else None
+        first = next(self._start)
+        for offset in range(self.slots):
+            lock_file = open(os.path.join(self.directory, f"slot-{(first + offset) % self.slots}.lock"), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            return lock_file
+        return None
+
+    def _release(self, slot):
+        if fcntl is None:
+            self._semaphore.release()
+            return
+        # Closing the file drops its lock
+        slot.close()
+
+
+class MemoryBudget:
+    """Bytes of raster memory the jobs of this process may use at once"""
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BUDGET, timeout=None):
+        self.max_bytes = max_bytes
+        # Seconds a job waits for room before AdmissionError (None: as long as it takes)
+        self.timeout = timeout
+        self.reserved = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """Wait until ``nbytes`` fit in the budget and hold them for the duration"""
+        # A job bigger than the whole budget runs once it has the budget to itself
+        nbytes = min(nbytes, self.max_bytes)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.reserved + nbytes <= self.max_bytes, self.timeout):
+                raise AdmissionError(f"no room for {nbytes / 2**20:.0f}MB of raster memory within {self.timeout}s "
+                                     f"({self.reserved / 2**20:.0f}MB of {self.max_bytes / 2**20:.0f}MB in use)")
+            self.reserved += nbytes
+            metrics.MEMORY_RESERVED_BYTES.set(self.reserved)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.reserved -= nbytes
+                metrics.MEMORY_RESERVED_BYTES.set(self.reserved)
+                self._condition.notify_all()
@@ -1,18 +1,287 @@
-from flask import Flask, request, render_template, send_file, jsonify
+from flask import Flask, Request, Response, current_app, request, render_template, send_file, jsonify
+import io
+import logging
 import os
-import tempfile
-from pdf_processor import PDFProcessor
+import threading
+import time
+import engine
+import metrics
+from engine import QUALITY_PROFILES, DEFAULT_QUALITY
+from imposition import PROFILES as IMPOSITION_PROFILES, DEFAULT_PROFILE
+from result_cache import ResultCache, DEFAULT_MAX_BYTES as RESULT_CACHE_MAX_BYTES
+from jobs import JobQueue, QUEUED, RUNNING
 import uuid
 
+
+
+class InMemoryUploadRequest(Request):
+    """Keep small uploads in memory instead of Werkzeug's spooled temp files"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if _fits_in_memory(total_content_length):
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+def _fits_in_memory(content_length):
+    return content_length is not None and content_length <= current_app.config['IN_MEMORY_MAX_BYTES']
+
+
+# LOG_LEVEL=DEBUG logs every card and sheet; the default logs one line per job
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s %(message)s',
+)
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Requests up to this size are converted without touching the disk
+app.config['IN_MEMORY_MAX_BYTES'] = 4 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
+# Rendered cards are reused across uploads (raster mode only)
+app.config['RASTER_CACHE_FOLDER'] = engine.user_cache_dir('pdf_converter_raster_cache')
+app.config['RASTER_CACHE_MAX_BYTES'] = None  # the raster cache's default
+# Raster backend (render_backends.py: pdfium or poppler); None uses the first one installed
+app.config['RENDER_BACKEND'] = os.environ.get('RENDER_BACKEND') or None
+# Finished outputs, by upload hash and settings; re-uploads are answered from here
+app.config['RESULT_CACHE_FOLDER'] = os.path.join(app.config['OUTPUT_FOLDER'], 'results')
+app.config['RESULT_CACHE_MAX_BYTES'] = RESULT_CACHE_MAX_BYTES
+# Outputs (and their job status) are kept this long after they were last produced or reused,
+# so retries, resumed downloads and other devices don't need a new conversion
+app.config['OUTPUT_RETENTION_SECONDS'] = 24 * 60 * 60
+# How often expired outputs and abandoned uploads are cleaned up
+app.config['CLEANUP_INTERVAL_SECONDS'] = 10 * 60
+# Conversions run in the background on this many worker threads (per server process)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# Job states, shared by the server's worker processes so any of them can answer /jobs and /download
+app.config['JOB_STATE_FOLDER'] = os.path.join(app.config['OUTPUT_FOLDER'], 'jobs')
+# Past this many conversions in flight (queued, running or streaming) in one process, uploads
+# are refused with 429 and Retry-After instead of queueing more than the workers can finish
+app.config['MAX_IN_FLIGHT_JOBS'] = int(os.environ.get('MAX_IN_FLIGHT_JOBS', 8))
+app.config['RETRY_AFTER_SECONDS'] = 10
+# Admission control for the raster path: renders running at once, counted across
+# every server process of this user (through lock files), and the raster memory the jobs of
+# one process may hold (estimated from pages and DPI). A job waits for room, and fails once it
+# has waited ADMISSION_TIMEOUT_SECONDS for memory.
+app.config['RENDER_SLOTS'] = int(os.environ.get('RENDER_SLOTS', os.cpu_count() or 1))
+app.config['RENDER_LOCK_FOLDER'] = None  # the lock directory every app of this user shares
+app.config['MEMORY_BUDGET_BYTES'] = int(os.environ.get('MEMORY_BUDGET_BYTES', 1024 * 1024 * 1024))
+app.config['ADMISSION_TIMEOUT_SECONDS'] = 5 * 60
 
 # Create directories if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+result_cache = ResultCache(app.config['RESULT_CACHE_FOLDER'], app.config['RESULT_CACHE_MAX_BYTES'])
+job_queue = JobQueue(workers=app.config['JOB_WORKERS'], retention=app.config['OUTPUT_RETENTION_SECONDS'],
+                     state_dir=app.config['JOB_STATE_FOLDER'])
+
+# Streamed conversions run on request threads, outside the job queue
+_streams_lock = threading.Lock()
+_streams_in_flight = 0
+
+
+def _remove_files(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _remove_stale_files(folder, max_age):
+    """Remove files in ``folder`` older than ``max_age`` seconds (inputs and partial outputs of crashed jobs)"""
+    cutoff = time.time() - max_age
+    for entry in os.scandir(folder):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _cleanup_loop():
+    """Time-based cleanup: expire outputs past their retention period, whether or not they were downloaded"""
+    while True:
+        time.sleep(app.config['CLEANUP_INTERVAL_SECONDS'])
+        retention = app.config['OUTPUT_RETENTION_SECONDS']
+        try:
+            result_cache.expire(retention)
+            _remove_stale_files(app.config['UPLOAD_FOLDER'], retention)
+            _remove_stale_files(app.config['OUTPUT_FOLDER'], retention)
+            _remove_stale_files(app.config['JOB_STATE_FOLDER'], retention)
+        except Exception:
+            logger.exception("Output cleanup failed")
+
+
+threading.Thread(target=_cleanup_loop, name='output-cleanup', daemon=True).start()
+
+
+def _engine_options():
+    """The raster backend, and the process-wide raster cache and admission control, of every processor"""
+    return {
+        'render_backend': app.config['RENDER_BACKEND'],
+        'raster_cache': engine.raster_cache(app.config['RASTER_CACHE_FOLDER'], app.config['RASTER_CACHE_MAX_BYTES']),
+        'render_gate': engine.render_gate(app.config['RENDER_SLOTS'], app.config['RENDER_LOCK_FOLDER']),
+        'memory_budget': engine.memory_budget(app.config['MEMORY_BUDGET_BYTES'],
+                                              app.config['ADMISSION_TIMEOUT_SECONDS']),
+    }
+
+
+def _processor(options):
+    """The process-wide processor for a request's settings (the engine loads on first use)"""
+    return engine.processor(**_engine_options(), **options)
+
+
+def _in_flight():
+    with _streams_lock:
+        return job_queue.in_flight() + _streams_in_flight
+
+
+def _stream_started():
+    global _streams_in_flight
+    with _streams_lock:
+        _streams_in_flight += 1
+
+
+def _stream_done():
+    global _streams_in_flight
+    with _streams_lock:
+        _streams_in_flight -= 1
+
+
+def _overloaded():
+    """A 429 response if this process already has as many conversions in flight as it takes, else None
+
+    Checked before the upload is read, so a refused request costs next to nothing.
+    """
+    if _in_flight() < app.config['MAX_IN_FLIGHT_JOBS']:
+        return None
+    metrics.REQUESTS_REJECTED.inc(endpoint=request.endpoint)
+    retry_after = app.config['RETRY_AFTER_SECONDS']
+    response = jsonify({'error': 'Server is busy, please try again later', 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _requested_options():
+    """PDFProcessor settings from the request's form fields, and an error response if one is unknown
+
+    ``quality`` names a raster quality profile, ``imposition`` a sheet layout,
+    and ``auto_pack`` (1/true/on) re-grids that layout to fit the most cards.
+    """
+    quality = request.form.get('quality') or DEFAULT_QUALITY
+    if quality not in QUALITY_PROFILES:
+        return None, _unknown_choice('quality', QUALITY_PROFILES)
+    imposition = request.form.get('imposition') or DEFAULT_PROFILE
+    if imposition not in IMPOSITION_PROFILES:
+        return None, _unknown_choice('imposition', IMPOSITION_PROFILES)
+    auto_pack = request.form.get('auto_pack', '').lower() in ('1', 'true', 'on', 'yes')
+    return {'quality': quality, 'imposition': imposition, 'auto_pack': auto_pack}, None
+
+
+def _unknown_choice(field, choices):
+    return jsonify({'error': f"Unknown {field}, expected one of: {', '.join(choices)}"}), 400
+
+
+def _result_key(inputs, options):
+    """Result cache key of an upload: its PDFs (bytes or saved paths) and the processor settings"""
+    return result_cache.key(inputs, tuple(sorted(options.items())))
+
+
+def _store_result(key, file_id, processor, output):
+    """Put a job's output (a path or bytes) in the result cache; return the key it was stored under
+
+    A job that only produced the fallback layout is stored under a key of its
+    own, so its output can be downloaded but is never served to a later upload.
+    """
+    if processor.last_job['mode'] == 'fallback':
+        key = f"{key}-{file_id}"
+    if isinstance(output, str):
+        result_cache.put_file(key, output)
+    else:
+        result_cache.put_bytes(key, output)
+    return key
+
+
+def _job_result(file_id, filename, result_key):
+    return {
+        'download_url': f'/download/{file_id}',
+        'filename': filename,
+        'result_key': result_key,
+    }
+
+
+def convert_job(file_id, input_paths, output_path, filename, options, key, progress):
+    """Background job: lay out one PDF, or merge several first, into the result cache"""
+    # Write next to the final name, then move the finished output into the cache
+    part_path = output_path + '.part'
+    try:
+        processor = _processor(options)
+        if len(input_paths) == 1:
+            processor.process_pdf(input_paths[0], part_path, progress)
+        else:
+            processor.merge_and_process_pdfs(input_paths, part_path, progress)
+        result_key = _store_result(key, file_id, processor, part_path)
+    except Exception as e:
+        action = 'Processing' if len(input_paths) == 1 else 'Merge processing'
+        raise RuntimeError(f'{action} failed: {str(e)}') from e
+    finally:
+        # Identical uploads waiting on this job can now use the cache (or retry)
+        result_cache.release(key)
+        # Clean up uploaded inputs
+        _remove_files(part_path, *input_paths)
+
+    return _job_result(file_id, filename, result_key)
+
+
+def convert_bytes_job(file_id, pdf_datas, filename, options, key, progress):
+    """Background job: like convert_job, but for uploads held in memory"""
+    try:
+        processor = _processor(options)
+        if len(pdf_datas) == 1:
+            output = processor.process_pdf_bytes(pdf_datas[0], progress)
+        else:
+            output = processor.merge_and_process_pdf_bytes(pdf_datas, progress)
+        result_key = _store_result(key, file_id, processor, output)
+    except Exception as e:
+        action = 'Processing' if len(pdf_datas) == 1 else 'Merge processing'
+        raise RuntimeError(f'{action} failed: {str(e)}') from e
+    finally:
+        result_cache.release(key)
+
+    return _job_result(file_id, filename, result_key)
+
+
+def _job_accepted(file_id, filename, status=202, **extra):
+    return jsonify({
+        'success': True,
+        'job_id': file_id,
+        'status_url': f'/jobs/{file_id}',
+        'download_url': f'/download/{file_id}',
+        'filename': filename,
+        **extra
+    }), status
+
+
+def _answer_from_cache(key, file_id, filename):
+    """Answer an upload whose output is cached, or already being produced by another job
+
+    Returns None if the upload needs converting; the caller then holds the
+    claim on ``key`` and must submit the job (which releases it) or release it.
+    """
+    owner = result_cache.claim(key, file_id)
+    if owner != file_id:
+        # An identical upload is being converted right now: wait for that job instead
+        return _job_accepted(owner, filename, coalesced=True)
+    if result_cache.get(key) is None:
+        return None
+    result_cache.release(key)
+    job_queue.complete(_job_result(file_id, filename, key), job_id=file_id)
+    return _job_accepted(file_id, filename, status=200, cached=True)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -23,6 +292,10 @@ def merge_page():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    busy = _overloaded()
+    if busy is not None:
+        return busy
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
@@ -32,43 +305,111 @@ def upload_file():
     
     if not file.filename.lower().endswith('.pdf'):
         return jsonify({'error': 'Please upload a PDF file'}), 400
+
+    options, error = _requested_options()
+    if error is not None:
+        return error
     
+    # Generate unique filename
+    file_id = str(uuid.uuid4())
+    input_filename = f"{file_id}_input.pdf"
+    output_filename = f"{file_id}_output.pdf"
+
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+
+    key = None
     try:
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        input_filename = f"{file_id}_input.pdf"
-        output_filename = f"{file_id}_output.pdf"
-        
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        
-        # Save uploaded file
+        filename = f"converted_{file.filename}"
+        if _fits_in_memory(request.content_length):
+            pdf_data = file.read()
+            key = _result_key([pdf_data], options)
+            cached = _answer_from_cache(key, file_id, filename)
+            if cached is not None:
+                return cached
+            job_queue.submit(convert_bytes_job, file_id, [pdf_data], filename, options, key, job_id=file_id)
+            return _job_accepted(file_id, filename)
+
+        # Save uploaded file; the conversion itself runs in the background
         file.save(input_path)
-        
-        # Process PDF
-        processor = PDFProcessor()
-        processor.process_pdf(input_path, output_path)
-        
-        # Clean up input file
-        os.remove(input_path)
-        
-        return jsonify({
-            'success': True,
-            'download_url': f'/download/{file_id}',
-            'filename': f"converted_{file.filename}"
-        })
-        
+        key = _result_key([input_path], options)
+        cached = _answer_from_cache(key, file_id, filename)
+        if cached is not None:
+            _remove_files(input_path)
+            return cached
+        job_queue.submit(convert_job, file_id, [input_path], output_path, filename, options, key, job_id=file_id)
+        return _job_accepted(file_id, filename)
+
     except Exception as e:
         # Clean up files on error
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
-        
+        if key is not None:
+            result_cache.release(key)
+        _remove_files(input_path)
         return jsonify({'error': f'Processing failed: {str(e)}'}), 500
 
+@app.route('/upload-stream', methods=['POST'])
+def upload_stream():
+    """Convert an upload and stream the result back in the same response
+
+    Each sheet is sent as soon as it's composed (chunked transfer encoding), so
+    print spoolers can start before the job is done.
+    """
+    busy = _overloaded()
+    if busy is not None:
+        return busy
+
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    if not file.filename.lower().endswith('.pdf'):
+        return jsonify({'error': 'Please upload a PDF file'}), 400
+
+    options, error = _requested_options()
+    if error is not None:
+        return error
+
+    file_id = str(uuid.uuid4())
+    if _fits_in_memory(request.content_length):
+        source = file.read()
+    else:
+        source = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_id}_input.pdf")
+        file.save(source)
+
+    # A cached output is sent whole; a streamed conversion isn't stored
+    cached_path = result_cache.get(_result_key([source], options))
+    if cached_path is not None:
+        if isinstance(source, str):
+            _remove_files(source)
+        return send_file(os.path.abspath(cached_path), as_attachment=True,
+                         download_name=f"converted_layout_{file_id}.pdf", mimetype='application/pdf')
+
+    def generate():
+        try:
+            processor = _processor(options)
+            yield from processor.stream_pdf(source)
+        finally:
+            if isinstance(source, str):
+                _remove_files(source)
+
+    _stream_started()
+    response = Response(generate(), mimetype='application/pdf', headers={
+        'Content-Disposition': f'attachment; filename="converted_layout_{file_id}.pdf"',
+        'X-Accel-Buffering': 'no',
+    })
+    # The server closes the response when the stream ends or the client goes away
+    response.call_on_close(_stream_done)
+    return response
+
 @app.route('/merge-upload', methods=['POST'])
 def merge_upload():
+    busy = _overloaded()
+    if busy is not None:
+        return busy
+
     if 'files' not in request.files:
         return jsonify({'error': 'No files uploaded'}), 400
 
@@ -76,17 +417,26 @@ def merge_upload():
     if len(files) < 2:
         return jsonify({'error': 'Please upload at least two PDF files'}), 400
 
+    options, error = _requested_options()
+    if error is not None:
+        return error
+
     temp_paths = []
     input_paths = []
+    key = None
     file_id = str(uuid.uuid4())
     output_filename = f"{file_id}_output.pdf"
     output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    in_memory = _fits_in_memory(request.content_length)
 
     try:
-        # Save all uploaded PDFs temporarily
+        # Keep all uploaded PDFs in memory, or save them temporarily
         for f in files:
             if not f.filename.lower().endswith('.pdf'):
                 continue
+            if in_memory:
+                input_paths.append(f.read())
+                continue
             temp_name = f"{uuid.uuid4()}_input.pdf"
             temp_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_name)
             f.save(temp_path)
@@ -100,44 +450,62 @@ def merge_upload():
                     os.remove(p)
             return jsonify({'error': 'Please upload at least two valid PDF files'}), 400
 
-        # Process: merge then layout
-        processor = PDFProcessor()
-        processor.merge_and_process_pdfs(input_paths, output_path)
-
-        # Cleanup uploaded temp inputs
-        for p in temp_paths:
-            if os.path.exists(p):
-                os.remove(p)
-
-        return jsonify({
-            'success': True,
-            'download_url': f'/download/{file_id}',
-            'filename': f"merged_output_{file_id}.pdf"
-        })
+        # Process in the background: merge then layout
+        filename = f"merged_output_{file_id}.pdf"
+        key = _result_key(input_paths, options)
+        cached = _answer_from_cache(key, file_id, filename)
+        if cached is not None:
+            _remove_files(*temp_paths)
+            return cached
+        if in_memory:
+            job_queue.submit(convert_bytes_job, file_id, input_paths, filename, options, key, job_id=file_id)
+        else:
+            job_queue.submit(convert_job, file_id, input_paths, output_path, filename, options, key,
+                             job_id=file_id)
+        return _job_accepted(file_id, filename)
 
     except Exception as e:
         # Cleanup on error
-        for p in temp_paths:
-            if os.path.exists(p):
-                os.remove(p)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        if key is not None:
+            result_cache.release(key)
+        _remove_files(*temp_paths)
         return jsonify({'error': f'Merge processing failed: {str(e)}'}), 500
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Conversion metrics of this process in the Prometheus text format"""
+    metrics.QUEUE_PENDING.set(job_queue.pending())
+    metrics.JOBS_IN_FLIGHT.set(_in_flight())
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/download/<file_id>')
 def download_file(file_id):
-    output_filename = f"{file_id}_output.pdf"
-    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-    
-    if not os.path.exists(output_path):
+    status = job_queue.status(file_id)
+    if status is not None and status['state'] in (QUEUED, RUNNING):
+        return jsonify({'error': 'File is not ready yet', 'status_url': f'/jobs/{file_id}'}), 409
+
+    output_path = result_cache.path(status['result_key']) if status and 'result_key' in status else None
+    if output_path is None:
         return jsonify({'error': 'File not found'}), 404
-    
+
     try:
-        return send_file(output_path, as_attachment=True, download_name=f"converted_layout_{file_id}.pdf")
-    finally:
-        # Clean up output file after download
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        # By path: Werkzeug answers Range and If-None-Match requests itself (206/304) and hands
+        # the open file to the server's wsgi.file_wrapper, which sends it with sendfile()
+        return send_file(os.path.abspath(output_path), as_attachment=True,
+                         download_name=f"converted_layout_{file_id}.pdf", mimetype='application/pdf',
+                         etag=status['result_key'], conditional=True)
+    except FileNotFoundError:
+        # Expired or evicted since the lookup
+        return jsonify({'error': 'File not found'}), 404
 
 if __name__ == '__main__':
+    # Development server (see serve.py for production); load the layout code now rather than on the first request
+    engine.preload(**_engine_options())
     app.run(debug=True, host='0.0.0.0', port=5002)
@@ -0,0 +1,210 @@
+"""
+Headless batch converter: lay out many PDFs without the web app
+
+Inputs are PDF files, directories (every *.pdf in them) or glob patterns.
+Each input is converted with PDFProcessor.process_pdf in a pool of worker
+processes, one file per task, largest files first so a big file doesn't start
+last and hold up the end of the batch. Outputs are named like the web app's
+downloads (converted_<name>), next to their input or in --output-dir.
+
+Each output is written with a sidecar (<output>.options.json) recording the
+conversion options it was made with (mode, quality, imposition, auto-pack,
+render backend). An output that is newer than its input and was made with the
+same options is up to date and skipped, unless --force is given; one without a
+sidecar, or made with other options, is converted again. A job that ends in
+the fallback layout counts as failed and leaves no output, so the next run
+retries it. The batch ends with a throughput summary (files/s, pages/s) and
+exits with status 1 if any file failed.
+
+Usage: python batch_convert.py INPUT [INPUT ...] [-o DIR] [-j JOBS] [--force]
+                               [--mode auto|vector|raster] [--quality print]
+                               [--imposition default] [--auto-pack]
+                               [--raster-cache DIR] [--render-slots N]
+                               [--render-backend pdfium|poppler] [-v]
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import engine
+from engine import QUALITY_PROFILES, DEFAULT_QUALITY, RENDER_MODES
+from imposition import PROFILES as IMPOSITION_PROFILES, DEFAULT_PROFILE
+from render_backends import BACKENDS as RENDER_BACKENDS
+
+logger = logging.getLogger('batch_convert')
+
+OUTPUT_PREFIX = 'converted_'
+# Next to each output: the options it was converted with
+OPTIONS_SUFFIX = '.options.json'
+
+
+def find_inputs(patterns, recursive=False):
+    """Expand files, directories and glob patterns into a sorted list of unique PDF paths"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = glob.glob(os.path.join(pattern, '**' if recursive else '', '*.pdf'), recursive=recursive)
+        elif glob.has_magic(pattern):
+            found = glob.glob(pattern, recursive=True)
+        else:
+            found = [pattern]
+        paths.update(os.path.normpath(path) for path in found
+                     if path.lower().endswith('.pdf') and os.path.isfile(path))
+    return sorted(paths)
+
+
+def output_path_for(input_path, output_dir=None):
+    directory = output_dir if output_dir is not None else os.path.dirname(input_path)
+    return os.path.join(directory, OUTPUT_PREFIX + os.path.basename(input_path))
+
+
+def is_up_to_date(input_path, output_path, options):
+    """True if ``output_path`` exists, was written after ``input_path`` last changed, and with ``options``"""
+    try:
+        if os.path.getmtime(output_path) < os.path.getmtime(input_path):
+            return False
+        with open(output_path + OPTIONS_SUFFIX, encoding='utf-8') as sidecar:
+            return json.load(sidecar) == options
+    except (OSError, ValueError):
+        return False
+
+
+def _write_options(output_path, options):
+    """Record the options an output was converted with, replacing the sidecar in one step"""
+    sidecar_path = output_path + OPTIONS_SUFFIX
+    with open(sidecar_path + '.part', 'w', encoding='utf-8') as sidecar:
+        json.dump(options, sidecar, sort_keys=True)
+    os.replace(sidecar_path + '.part', sidecar_path)
+
+
+def convert_file(input_path, output_path, options, raster_cache_dir=None, render_slots=None):
+    """Worker task: lay out one PDF; return its page count and layout path
+
+    Writes next to the final name first, so an interrupted batch never leaves a
+    half-written output that would look up to date; the options sidecar is
+    written last, so an output whose sidecar didn't make it is converted again.
+    """
+    # Built on a worker's first file and reused for the rest
+    raster_cache = engine.raster_cache(raster_cache_dir) if raster_cache_dir else None
+    # The same render slots as the web apps, so a batch on a server leaves them room
+    render_gate = engine.render_gate(render_slots) if render_slots else None
+    processor = engine.processor(raster_cache=raster_cache, render_gate=render_gate, **options)
+    part_path = output_path + '.part'
+    try:
+        processor.process_pdf(input_path, part_path)
+        if processor.last_job['mode'] == 'fallback':
+            raise RuntimeError("layout failed, only the fallback layout could be written")
+        os.replace(part_path, output_path)
+        _write_options(output_path, options)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return processor.last_job['pages'], processor.last_job['mode']
+
+
+def run(tasks, options, jobs, raster_cache_dir=None, render_slots=None):
+    """Convert ``tasks`` ((input_path, output_path) pairs); return (files, pages, failed)"""
+    # Largest first: with one file per task, a big file picked up last would leave the other workers idle
+    tasks = sorted(tasks, key=lambda task: os.path.getsize(task[0]), reverse=True)
+    files = pages = 0
+    failed = []
+
+    def report(input_path, result=None, error=None):
+        nonlocal files, pages
+        if error is not None:
+            failed.append(input_path)
+            print(f"FAILED {input_path}: {error}", flush=True)
+            return
+        files += 1
+        pages += result[0]
+        print(f"{input_path}: {result[0]} pages ({result[1]})", flush=True)
+
+    if jobs == 1:
+        for input_path, output_path in tasks:
+            try:
+                report(input_path, convert_file(input_path, output_path, options, raster_cache_dir, render_slots))
+            except Exception as e:
+                report(input_path, error=e)
+        return files, pages, failed
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(convert_file, input_path, output_path, options, raster_cache_dir, render_slots): input_path
+            for input_path, output_path in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                report(futures[future], future.result())
+            except Exception as e:
+                report(futures[future], error=e)
+    return files, pages, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='PDF files, directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', default=None, help='write outputs here instead of next to each input')
+    parser.add_argument('-r', '--recursive', action='store_true', help='search input directories recursively')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('-f', '--force', action='store_true', help='convert inputs whose output is up to date too')
+    parser.add_argument('--mode', choices=RENDER_MODES, default='auto', help='render mode')
+    parser.add_argument('--quality', choices=QUALITY_PROFILES, default=DEFAULT_QUALITY, help='raster quality profile')
+    parser.add_argument('--imposition', choices=IMPOSITION_PROFILES, default=DEFAULT_PROFILE, help='sheet layout')
+    parser.add_argument('--auto-pack', action='store_true', help='fit as many cards as possible on the sheet')
+    parser.add_argument('--raster-cache', default=None, help='directory of a raster cache shared by the workers')
+    parser.add_argument('--render-slots', type=int, default=None,
+                        help='raster renders at once, shared with the web apps of this user (default: no limit)')
+    parser.add_argument('--render-backend', choices=RENDER_BACKENDS, default=None,
+                        help='raster backend (default: the first one installed)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every job')
+    args = parser.parse_args(argv)
+
+    # Worker processes inherit this configuration (fork) or the library defaults (spawn)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s %(levelname)s %(name)s %(message)s',
+    )
+
+    input_paths = find_inputs(args.inputs, args.recursive)
+    # Don't pick up our own outputs when they sit next to the inputs
+    input_paths = [path for path in input_paths if not os.path.basename(path).startswith(OUTPUT_PREFIX)]
+    if not input_paths:
+        parser.error("no PDF files found")
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    options = {'render_mode': args.mode, 'quality': args.quality,
+               'imposition': args.imposition, 'auto_pack': args.auto_pack, 'render_backend': args.render_backend}
+    tasks = []
+    outputs = {}
+    skipped = 0
+    for input_path in input_paths:
+        output_path = output_path_for(input_path, args.output_dir)
+        if output_path in outputs:
+            parser.error(f"{input_path} and {outputs[output_path]} would both be written to {output_path}")
+        outputs[output_path] = input_path
+        if not args.force and is_up_to_date(input_path, output_path, options):
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path))
+
+    jobs = max(1, min(args.jobs, len(tasks)))
+    start = time.perf_counter()
+    files, pages, failed = run(tasks, options, jobs, args.raster_cache, args.render_slots) if tasks else (0, 0, [])
+    seconds = time.perf_counter() - start
+
+    rate = (lambda count: count / seconds) if seconds > 0 else (lambda count: 0.0)
+    print(f"Converted {files} files ({pages} pages) in {seconds:.2f}s with {jobs} workers: "
+          f"{rate(files):.2f} files/s, {rate(pages):.1f} pages/s; "
+          f"{skipped} up to date, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Raster backends compared on the card corpus
+
+Every installed backend converts the same synthetic input of each card kind;
+reported are the job's wall time, the time spent in the render stage and the
+output size. The last column is how far each backend's cards are from the
+first backend's (mean absolute pixel difference, 0-255), rendered straight
+from the input at the size the job rendered them at.
+
+Usage: python -m benchmarks.bench_backends [--pages 16] [--kinds text vector photo mixed]
+                                           [--backends pdfium poppler] [--workers 1]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from PIL import ImageChops, ImageStat
+from PyPDF2 import PdfReader
+
+from benchmarks.corpus import CARD_KINDS, generate_cards
+from pdf_processor import PDFProcessor
+from render_backends import available_backends, get_backend
+
+# Cards compared pixel by pixel, per kind
+COMPARED_PAGES = 4
+
+
+def _difference(reference, images):
+    """Mean absolute difference between two lists of renders, averaged over pages and channels"""
+    total = 0.0
+    for expected, image in zip(reference, images):
+        total += sum(ImageStat.Stat(ImageChops.difference(expected.convert('RGB'), image.convert('RGB'))).mean) / 3
+    return total / len(reference)
+
+
+def _load(images):
+    """Renders as PIL images, reading (and deleting) the files a backend wrote"""
+    from PIL import Image
+    loaded = []
+    for image in images:
+        if isinstance(image, str):
+            with Image.open(image) as img:
+                loaded.append(img.convert('RGB'))
+            os.unlink(image)
+        else:
+            loaded.append(image)
+    return loaded
+
+
+def run(pages, kinds, backends, workers):
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_path = os.path.join(work_dir, 'output.pdf')
+        print(f"{'kind':>8} {'backend':>8} {'seconds':>10} {'pages/s':>10} {'render s':>10} {'output KB':>10} {'diff':>6}")
+        for kind in kinds:
+            input_path = generate_cards(os.path.join(work_dir, f'{kind}.pdf'), pages, kind=kind)
+            reference = None
+            for name in backends:
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        processor = PDFProcessor(render_mode='raster', workers=workers, render_backend=name)
+                        start = time.perf_counter()
+                        processor.process_pdf(input_path, output_path)
+                        elapsed = time.perf_counter() - start
+
+                    # The size the job rendered its (identically sized) cards at
+                    target = processor._render_target(PdfReader(input_path).pages[0])
+                    images = _load(get_backend(name).render(input_path, 1, min(pages, COMPARED_PAGES),
+                                                            size=(target.width, target.height), output_folder=work_dir))
+                    get_backend(name).release([input_path])
+                except Exception as e:
+                    # e.g. poppler's module installed but not its programs
+                    print(f"{kind:>8} {name:>8} unavailable: {type(e).__name__}: {e}")
+                    continue
+                reference = reference or images
+                print(f"{kind:>8} {name:>8} {elapsed:>10.2f} {pages / elapsed:>10.1f} "
+                      f"{processor.stage_times.get('render', 0.0):>10.2f} "
+                      f"{os.path.getsize(output_path) / 1024:>10.0f} {_difference(reference, images):>6.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=16, help='cards in each synthetic input')
+    parser.add_argument('--kinds', nargs='+', choices=CARD_KINDS, default=list(CARD_KINDS), help='card kinds')
+    parser.add_argument('--backends', nargs='+', choices=available_backends(), default=list(available_backends()),
+                        help='backends to compare (default: every one installed)')
+    parser.add_argument('--workers', type=int, default=1, help='render worker processes')
+    args = parser.parse_args()
+    if not args.backends:
+        parser.error("no raster backend installed (pip install pypdfium2, or pdf2image and poppler)")
+    run(args.pages, args.kinds, args.backends, args.workers)
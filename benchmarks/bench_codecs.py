@@ -0,0 +1,78 @@
+"""
+Encode time and output size of each raster codec
+
+For every codec setting this times encode_card() on the rendered cards alone,
+then runs a whole raster job with it and reports the job time and the output
+size. The ``pil`` codec does no work in encode_card(); ReportLab compresses
+its images while drawing the sheet, so compare it on job time.
+
+Each setting runs with and without depth reduction (``+depth``: gray and
+bilevel cards embedded at 8 and 1 bits per pixel); the depth column counts
+the cards classified color/gray/bilevel. Text cards render gray; photo cards
+stay color.
+
+Usage: python -m benchmarks.bench_codecs [--pages 16] [--kind text] [--jpeg-quality 75 90 95] [--flate-level 1 6 9]
+"""
+
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+from benchmarks.corpus import CARD_KINDS, generate_cards
+from pdf_processor import CARD_DEPTHS, PDFProcessor, card_depth, encode_card
+from render_backends import get_backend
+
+
+def _codec_settings(jpeg_qualities, flate_levels):
+    yield 'pil', {'codec': 'pil'}
+    for quality in jpeg_qualities:
+        yield f'jpeg q{quality}', {'codec': 'jpeg', 'jpeg_quality': quality}
+    for level in flate_levels:
+        yield f'flate {level}', {'codec': 'flate', 'flate_level': level}
+
+
+def _settings(jpeg_qualities, flate_levels):
+    for label, options in _codec_settings(jpeg_qualities, flate_levels):
+        yield label, dict(options, reduce_depth=False)
+        yield f'{label}+depth', dict(options, reduce_depth=True)
+
+
+def run(pages, kind, jpeg_qualities, flate_levels):
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_path = generate_cards(os.path.join(work_dir, 'cards.pdf'), pages, kind=kind)
+        output_path = os.path.join(work_dir, 'output.pdf')
+        images = get_backend().render(input_path, 1, pages, dpi=300)
+        depths = [card_depth(img)[0] for img in images]
+        print("depth: " + ", ".join(f"{depths.count(depth)} {depth}" for depth in CARD_DEPTHS))
+
+        print(f"{'codec':>16} {'encode ms/card':>15} {'job seconds':>12} {'output KiB':>11} {'KiB/card':>9}")
+        for label, options in _settings(jpeg_qualities, flate_levels):
+            codec = options['codec']
+            encode_args = (codec, options.get('jpeg_quality', 90), options.get('flate_level', 6),
+                           options['reduce_depth'])
+
+            start = time.perf_counter()
+            for img in images:
+                encode_card(img, *encode_args)
+            encode_ms = (time.perf_counter() - start) * 1000 / len(images)
+
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                processor = PDFProcessor(render_mode='raster', **options)
+                start = time.perf_counter()
+                processor.process_pdf(input_path, output_path)
+                elapsed = time.perf_counter() - start
+
+            size_kib = os.path.getsize(output_path) / 1024
+            print(f"{label:>16} {encode_ms:>15.1f} {elapsed:>12.2f} {size_kib:>11.0f} {size_kib / pages:>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=16, help='cards in the synthetic input')
+    parser.add_argument('--kind', choices=CARD_KINDS, default='text', help='kind of cards')
+    parser.add_argument('--jpeg-quality', type=int, nargs='+', default=[75, 90, 95], help='JPEG qualities to try')
+    parser.add_argument('--flate-level', type=int, nargs='+', default=[1, 6, 9], help='Flate levels to try')
+    args = parser.parse_args()
+    run(args.pages, args.kind, args.jpeg_quality, args.flate_level)
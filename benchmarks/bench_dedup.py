@@ -0,0 +1,45 @@
+"""
+Output size against the number of distinct cards in a job
+
+Each run lays out the same number of cards drawn from a varying number of
+distinct designs. Identical cards are embedded once, so the output size
+should follow the number of designs, not the number of pages.
+
+Usage: python -m benchmarks.bench_dedup [--pages 40] [--designs 1 4 40] [--mode vector raster]
+"""
+
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+from benchmarks.corpus import generate_cards
+from pdf_processor import PDFProcessor
+
+
+def run(pages, design_counts, modes):
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_path = os.path.join(work_dir, 'output.pdf')
+
+        print(f"{'mode':>8} {'designs':>8} {'seconds':>10} {'output KiB':>11}")
+        for designs in design_counts:
+            input_path = generate_cards(os.path.join(work_dir, f'cards_{designs}.pdf'), pages, designs=designs)
+            for mode in modes:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    processor = PDFProcessor(render_mode=mode)
+                    start = time.perf_counter()
+                    processor.process_pdf(input_path, output_path)
+                    elapsed = time.perf_counter() - start
+
+                size_kib = os.path.getsize(output_path) / 1024
+                print(f"{mode:>8} {designs:>8} {elapsed:>10.2f} {size_kib:>11.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=40, help='cards in each synthetic input')
+    parser.add_argument('--designs', type=int, nargs='+', default=[1, 4, 40], help='distinct cards per input')
+    parser.add_argument('--mode', nargs='+', choices=('vector', 'raster'), default=['vector', 'raster'])
+    args = parser.parse_args()
+    run(args.pages, args.designs, args.mode)
@@ -0,0 +1,118 @@
+"""
+Peak memory of process_pdf against page count
+
+The layout pipeline works one window of sheets at a time and writes each
+finished sheet straight to the output file, so the memory it needs on top of
+the parsed input only grows by the little a job has to keep per page: the
+digest that dedupes it, its digests of the objects the page uses, and the xref
+offsets of what was written for it (and in raster mode the key of the card
+drawn for it). This measures tracemalloc peaks for parsing the input alone and
+for the whole job; the difference (the pipeline's overhead) may exceed the
+first page count's by PER_PAGE_BYTES[mode] for every further page, plus
+NOISE_BYTES however many pages there are. Otherwise the script exits with
+status 1 (tests/test_memory.py runs the same check under pytest).
+
+Usage: python -m benchmarks.bench_memory [--mode vector|raster] [--pages N ...]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import PyPDF2
+from PyPDF2.generic import IndirectObject
+
+from benchmarks.corpus import generate_cards
+from pdf_processor import PDFProcessor
+
+# Pipeline memory a job may keep per page (see above); anything retained per
+# sheet or per card (a content stream, a rendered image) is far bigger. A raster
+# job also maps every page to the card it embedded, to reuse it for repeats
+PER_PAGE_BYTES = {'vector': 640, 'raster': 1024}
+# Allowance for allocator and garbage collector timing; fixed, so a large
+# reference (a raster job's render window) can't hide per-page growth
+NOISE_BYTES = 64 * 1024
+DEFAULT_PAGES = {'vector': [16, 256, 1024], 'raster': [32, 64, 160]}
+
+
+def _traced_peak(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _parse_input(input_path):
+    """Parse the input and resolve every object in it, as PyPDF2 caches them"""
+    with open(input_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        # PyPDF2 caches the boxes in the page dictionaries once they're read
+        for page in pdf_reader.pages:
+            page.mediabox
+            page.cropbox
+        for generation, objects in pdf_reader.xref.items():
+            for idnum in objects:
+                pdf_reader.get_object(IndirectObject(idnum, generation, pdf_reader))
+
+
+def measure(mode, page_counts):
+    """Yield (pages, parse peak, job peak, pipeline overhead) in bytes for each page count"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_path = os.path.join(work_dir, 'output.pdf')
+        with contextlib.redirect_stdout(io.StringIO()):
+            processor = PDFProcessor(render_mode=mode)
+
+        inputs = [(pages, generate_cards(os.path.join(work_dir, f'cards_{pages}.pdf'), pages))
+                  for pages in page_counts]
+        # One untraced job first, so what a process only sets up once (imports, the
+        # raster backend, module-level caches) doesn't inflate the reference
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            processor.process_pdf(inputs[0][1], output_path)
+
+        for pages, input_path in inputs:
+            parse_peak = _traced_peak(_parse_input, input_path)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                job_peak = _traced_peak(processor.process_pdf, input_path, output_path)
+            yield pages, parse_peak, job_peak, max(0, job_peak - parse_peak)
+
+
+def limit(reference_pages, reference_overhead, pages, per_page_bytes):
+    """The most pipeline memory a job of ``pages`` may need, given the reference run"""
+    return reference_overhead + NOISE_BYTES + per_page_bytes * max(0, pages - reference_pages)
+
+
+def run(mode, page_counts, per_page_bytes):
+    print(f"{'pages':>8} {'parse KiB':>10} {'job KiB':>10} {'pipeline KiB':>13} {'limit KiB':>10}")
+    failed = []
+    reference = None
+    for pages, parse_peak, job_peak, overhead in measure(mode, page_counts):
+        reference = reference or (pages, overhead)
+        bound = limit(*reference, pages, per_page_bytes)
+        print(f"{pages:>8} {parse_peak // 1024:>10} {job_peak // 1024:>10} {overhead // 1024:>13} {bound // 1024:>10.0f}")
+        if overhead > bound:
+            failed.append(pages)
+
+    if failed:
+        print(f"FAIL: pipeline memory grows by more than {per_page_bytes} bytes per page "
+              f"(at {', '.join(map(str, failed))} pages)")
+        return 1
+    print(f"OK: pipeline memory grows by at most {per_page_bytes} bytes per page")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=('vector', 'raster'), default='vector')
+    parser.add_argument('--pages', type=int, nargs='+', default=None,
+                        help='page counts to compare; the first one is the reference and should '
+                             'fill at least one whole render window (default: 16 256 1024, raster: 32 64 160)')
+    parser.add_argument('--per-page-bytes', type=int, default=None,
+                        help='allowed growth per page beyond the reference (default: 640, raster: 1024)')
+    args = parser.parse_args()
+    sys.exit(run(args.mode, args.pages or DEFAULT_PAGES[args.mode], args.per_page_bytes or PER_PAGE_BYTES[args.mode]))
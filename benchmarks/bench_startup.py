@@ -0,0 +1,64 @@
+"""
+Web app startup time, with the engine loaded lazily or preloaded
+
+Each run is a fresh interpreter that imports the app and then lays out one
+small PDF, timing when it could start serving ("ready") and when the first
+job was done. "lazy" is the default import; "preload" also calls
+engine.preload() first, like the app's __main__ and the production server do.
+
+Usage: python -m benchmarks.bench_startup [--runs 5] [--pages 4]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.corpus import generate_cards
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a child interpreter with the repo as its working directory
+CHILD = """
+import sys, time
+start = time.perf_counter()
+import app, engine
+if sys.argv[1] == 'preload':
+    engine.preload(raster_cache=engine.raster_cache(app.app.config['RASTER_CACHE_FOLDER']))
+ready = time.perf_counter() - start
+processor = app._processor({'quality': engine.DEFAULT_QUALITY, 'imposition': 'default', 'auto_pack': False})
+processor.process_pdf(sys.argv[2], sys.argv[3])
+print(ready, time.perf_counter() - start)
+"""
+
+SCENARIOS = ('lazy', 'preload')
+
+
+def _run_child(scenario, input_path, output_path):
+    result = subprocess.run([sys.executable, '-c', CHILD, scenario, input_path, output_path],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    ready, first_job = result.stdout.split()[-2:]
+    return float(ready), float(first_job)
+
+
+def run(runs, pages):
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_path = generate_cards(os.path.join(work_dir, 'cards.pdf'), pages)
+        output_path = os.path.join(work_dir, 'output.pdf')
+
+        print(f"{'scenario':>10} {'ready ms':>10} {'first job ms':>13}")
+        for scenario in SCENARIOS:
+            timings = [_run_child(scenario, input_path, output_path) for _ in range(runs)]
+            ready = statistics.median(timing[0] for timing in timings)
+            first_job = statistics.median(timing[1] for timing in timings)
+            print(f"{scenario:>10} {ready * 1000:>10.1f} {first_job * 1000:>13.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per scenario (the median is shown)')
+    parser.add_argument('--pages', type=int, default=4, help='cards in the synthetic input')
+    args = parser.parse_args()
+    run(args.runs, args.pages)
@@ -0,0 +1,210 @@
+"""
+Regression suite: time and peak memory of whole jobs, stage by stage, against a stored baseline
+
+Every case lays out a synthetic corpus (text, vector, photo or mixed cards, see
+benchmarks.corpus) with process_pdf, or with merge_and_process_pdfs for cases
+split over several files. Each case is timed (best of ``--repeat``), with the
+time spent in every pipeline stage (PDFProcessor.stage_times), and then run
+once more under tracemalloc for its peak Python memory.
+
+Results are compared with benchmarks/baseline.json. A case regresses when its
+total time, a stage's time or its peak memory exceeds the baseline by more than
+the threshold (a fraction) plus the slack (an absolute allowance for noise in
+small numbers); the suite then exits with status 1. Cases missing from the
+baseline are reported but not compared. Timings depend on the machine (and
+raster cases on the raster backend, recorded with the baseline), so record a
+baseline with --update-baseline on the machine that runs the comparison.
+
+Usage: python -m benchmarks.bench_suite [--mode vector raster] [--max-pages 1000] [--case NAME ...]
+                                        [--repeat 3] [--no-memory] [--update-baseline]
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+from benchmarks.corpus import generate_cards
+from pdf_processor import PDFProcessor
+from render_backends import default_backend
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+STAGES = ('parse', 'render', 'encode', 'draw', 'save')
+
+# kind: card kind; pages: total cards; files: inputs to merge (1 = process_pdf)
+Case = namedtuple('Case', 'kind pages files mode')
+
+CASES = [
+    Case('text', 1, 1, 'vector'),
+    Case('text', 1000, 1, 'vector'),
+    Case('vector', 1000, 1, 'vector'),
+    Case('photo', 1000, 1, 'vector'),
+    Case('mixed', 100, 1, 'vector'),
+    Case('mixed', 1000, 10, 'vector'),
+    # Raster jobs render every card, so they are kept to a few render windows
+    Case('text', 1, 1, 'raster'),
+    Case('mixed', 16, 1, 'raster'),
+    Case('mixed', 48, 1, 'raster'),
+    Case('mixed', 32, 4, 'raster'),
+]
+
+
+def case_name(case):
+    merge = f"-merge{case.files}" if case.files > 1 else ""
+    return f"{case.kind}-{case.pages}{merge}-{case.mode}"
+
+
+def _inputs(case, work_dir):
+    """Generate (or reuse) the case's input files"""
+    pages_per_file = -(-case.pages // case.files)
+    paths = []
+    for number in range(case.files):
+        pages = min(pages_per_file, case.pages - number * pages_per_file)
+        path = os.path.join(work_dir, f"{case.kind}_{pages}_{number}.pdf")
+        if not os.path.exists(path):
+            # Numbered apart, so merged files don't repeat each other's cards
+            generate_cards(path, pages, seed=number, kind=case.kind, start=number * pages_per_file)
+        paths.append(path)
+    return paths
+
+
+def _run_job(case, input_paths, output_path):
+    # Don't charge this job for collecting the previous one's garbage
+    gc.collect()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        processor = PDFProcessor(render_mode=case.mode)
+        start = time.perf_counter()
+        if case.files == 1:
+            processor.process_pdf(input_paths[0], output_path)
+        else:
+            processor.merge_and_process_pdfs(input_paths, output_path)
+        return time.perf_counter() - start, processor.stage_times
+
+
+def measure(case, work_dir, repeat, memory):
+    input_paths = _inputs(case, work_dir)
+    output_path = os.path.join(work_dir, 'output.pdf')
+
+    seconds, stages = min((_run_job(case, input_paths, output_path) for _ in range(repeat)),
+                          key=lambda result: result[0])
+    result = {
+        'seconds': round(seconds, 4),
+        'stages': {stage: round(stages[stage], 4) for stage in STAGES if stage in stages},
+    }
+    if memory:
+        tracemalloc.start()
+        try:
+            _run_job(case, input_paths, output_path)
+            result['peak_kib'] = tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def compare(result, baseline, thresholds):
+    """Return a description of every metric of ``result`` that regressed against ``baseline``"""
+    time_threshold, time_slack, memory_threshold, memory_slack_kib = thresholds
+    regressions = []
+
+    def check(label, value, reference, threshold, slack, unit):
+        limit = reference * (1 + threshold) + slack
+        if value > limit:
+            regressions.append(f"{label} {value:g}{unit} > {limit:.4g}{unit} (baseline {reference:g}{unit})")
+
+    check('time', result['seconds'], baseline['seconds'], time_threshold, time_slack, 's')
+    for stage, seconds in result['stages'].items():
+        if stage in baseline.get('stages', {}):
+            check(stage, seconds, baseline['stages'][stage], time_threshold, time_slack, 's')
+    if 'peak_kib' in result and 'peak_kib' in baseline:
+        check('peak', result['peak_kib'], baseline['peak_kib'], memory_threshold, memory_slack_kib, 'KiB')
+    return regressions
+
+
+def _load_baseline(path):
+    if not os.path.exists(path):
+        return {'cases': {}}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def _save_baseline(path, baseline, results):
+    baseline['machine'] = {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'render_backend': default_backend(),
+    }
+    baseline.setdefault('cases', {}).update(results)
+    baseline['cases'] = dict(sorted(baseline['cases'].items()))
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+        baseline_file.write('\n')
+
+
+def run(cases, repeat, memory, thresholds, baseline_path, update_baseline):
+    baseline = _load_baseline(baseline_path)
+    results = {}
+    failed = []
+
+    print(f"{'case':>26} {'seconds':>8} {'pages/s':>8} " + " ".join(f"{stage:>7}" for stage in STAGES)
+          + f" {'peak KiB':>9}  vs baseline")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for case in cases:
+            name = case_name(case)
+            result = results[name] = measure(case, work_dir, repeat, memory)
+
+            reference = baseline['cases'].get(name)
+            if reference is None:
+                verdict = 'new'
+            else:
+                regressions = compare(result, reference, thresholds)
+                verdict = 'ok' if not regressions else 'REGRESSED: ' + '; '.join(regressions)
+                if regressions:
+                    failed.append(name)
+
+            stages = " ".join(f"{result['stages'].get(stage, 0):>7.3f}" for stage in STAGES)
+            peak = result.get('peak_kib', '-')
+            print(f"{name:>26} {result['seconds']:>8.3f} {case.pages / result['seconds']:>8.1f} {stages} "
+                  f"{peak:>9}  {verdict}", flush=True)
+
+    if update_baseline:
+        _save_baseline(baseline_path, baseline, results)
+        print(f"Baseline updated: {baseline_path}")
+        return 0
+    if failed:
+        print(f"FAIL: {len(failed)} of {len(cases)} cases regressed: {', '.join(failed)}")
+        return 1
+    print(f"OK: no regressions in {len(cases)} cases")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', nargs='+', choices=('vector', 'raster'), default=['vector', 'raster'])
+    parser.add_argument('--max-pages', type=int, default=None, help='skip cases with more pages')
+    parser.add_argument('--case', nargs='+', default=None, help='run only these cases (by name)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case; the fastest counts')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--time-threshold', type=float, default=0.5, help='allowed slowdown (fraction)')
+    parser.add_argument('--time-slack', type=float, default=0.05, help='allowed slowdown (seconds)')
+    parser.add_argument('--memory-threshold', type=float, default=0.10, help='allowed memory growth (fraction)')
+    parser.add_argument('--memory-slack-kib', type=int, default=256, help='allowed memory growth (KiB)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store this run as the baseline for the cases it ran')
+    args = parser.parse_args()
+
+    cases = [case for case in CASES
+             if case.mode in args.mode
+             and (args.max_pages is None or case.pages <= args.max_pages)
+             and (args.case is None or case_name(case) in args.case)]
+    thresholds = (args.time_threshold, args.time_slack, args.memory_threshold, args.memory_slack_kib)
+    sys.exit(run(cases, max(1, args.repeat), not args.no_memory, thresholds, args.baseline, args.update_baseline))
@@ -0,0 +1,49 @@
+"""
+Throughput of the raster path from 1 to N render workers
+
+Usage: python -m benchmarks.bench_workers [--pages 64] [--max-workers 16]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.corpus import generate_cards
+from pdf_processor import PDFProcessor
+
+
+def _worker_counts(max_workers):
+    count = 1
+    while count < max_workers:
+        yield count
+        count *= 2
+    yield max_workers
+
+
+def run(pages, max_workers):
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_path = generate_cards(os.path.join(work_dir, 'cards.pdf'), pages)
+        output_path = os.path.join(work_dir, 'output.pdf')
+
+        print(f"{'workers':>8} {'seconds':>10} {'pages/s':>10} {'speedup':>8}")
+        baseline = None
+        for workers in _worker_counts(max_workers):
+            with contextlib.redirect_stdout(io.StringIO()):
+                processor = PDFProcessor(render_mode='raster', workers=workers)
+                start = time.perf_counter()
+                processor.process_pdf(input_path, output_path)
+                elapsed = time.perf_counter() - start
+
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>10.2f} {pages / elapsed:>10.1f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=64, help='cards in the synthetic input')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1, help='largest worker count to try')
+    args = parser.parse_args()
+    run(args.pages, args.max_workers)
@@ -0,0 +1,106 @@
+"""
+Synthetic 128mm x 96mm card PDFs for benchmarks, generated locally with ReportLab
+
+Card kinds:
+    text   - a name badge: a border and a few lines of text
+    vector - a badge over dense vector art (curves, filled shapes, gradients of rectangles)
+    photo  - a badge over a full-bleed photo-like image
+    mixed  - text, vector and photo cards in turn
+"""
+
+import random
+
+from PIL import Image, ImageChops, ImageFilter
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+CARD_SIZE = (128 * mm, 96 * mm)
+
+CARD_KINDS = ('text', 'vector', 'photo', 'mixed')
+
+# Photo cards pick from this many distinct photos, like a real batch reusing a
+# few backgrounds, so 1000-page inputs stay a reasonable size
+PHOTO_POOL = 8
+PHOTO_PIXELS = (480, 360)
+
+
+def _draw_text_card(card_canvas, index):
+    """Name badge style card: a few lines of text and a border"""
+    width, height = CARD_SIZE
+    card_canvas.setStrokeColorRGB(0.2, 0.2, 0.2)
+    card_canvas.rect(4 * mm, 4 * mm, width - 8 * mm, height - 8 * mm)
+    card_canvas.setFont("Helvetica-Bold", 18)
+    card_canvas.drawString(10 * mm, height - 20 * mm, f"ID Card {index + 1:05d}")
+    card_canvas.setFont("Helvetica", 11)
+    for line in range(5):
+        card_canvas.drawString(10 * mm, height - (32 + line * 8) * mm, f"Field {line + 1}: value {index * 7 + line}")
+
+
+def _draw_vector_card(card_canvas, index, rng):
+    """Text card over a hundred or so curves and filled shapes"""
+    width, height = CARD_SIZE
+    # Banded background: many thin filled rectangles, as exported gradients are
+    for band in range(40):
+        shade = 0.75 + 0.25 * band / 40
+        card_canvas.setFillColorRGB(shade, shade * 0.95, 1)
+        card_canvas.rect(0, band * height / 40, width, height / 40 + 0.5, fill=1, stroke=0)
+    for _ in range(80):
+        card_canvas.setStrokeColorRGB(rng.random(), rng.random(), rng.random())
+        card_canvas.setLineWidth(rng.uniform(0.2, 1.5))
+        card_canvas.bezier(*(rng.uniform(0, width) if i % 2 == 0 else rng.uniform(0, height) for i in range(8)))
+    for _ in range(20):
+        card_canvas.setFillColorRGB(rng.random(), rng.random(), rng.random(), alpha=0.4)
+        card_canvas.circle(rng.uniform(0, width), rng.uniform(0, height), rng.uniform(2, 12) * mm, fill=1, stroke=0)
+    card_canvas.setFillColorRGB(0, 0, 0, alpha=1)
+    _draw_text_card(card_canvas, index)
+
+
+def _photo(seed):
+    """A smooth, noisy RGB image that compresses like a photo rather than like flat art"""
+    rng = random.Random(seed)
+    channels = []
+    for _ in range(3):
+        gradient = Image.linear_gradient('L').rotate(rng.uniform(0, 360)).resize(PHOTO_PIXELS)
+        noise = Image.effect_noise(PHOTO_PIXELS, rng.uniform(20, 40)).filter(ImageFilter.GaussianBlur(1))
+        channels.append(ImageChops.blend(gradient, noise, 0.35))
+    return Image.merge('RGB', channels)
+
+
+def _draw_photo_card(card_canvas, index, photos):
+    """Text card over a full-bleed image"""
+    width, height = CARD_SIZE
+    card_canvas.drawImage(photos[index % len(photos)], 0, 0, width=width, height=height)
+    card_canvas.setFillColorRGB(1, 1, 1)
+    # A white panel behind the text
+    card_canvas.rect(6 * mm, 26 * mm, width - 12 * mm, 58 * mm, fill=1, stroke=0)
+    card_canvas.setFillColorRGB(0, 0, 0)
+    _draw_text_card(card_canvas, index)
+
+
+def generate_cards(path, pages, seed=0, designs=None, kind='text', start=0):
+    """Write a PDF with ``pages`` cards of the given kind to ``path``
+
+    With ``designs``, only that many distinct cards are drawn, repeated in turn.
+    Cards are numbered from ``start``, so several files can hold different cards.
+    """
+    if kind not in CARD_KINDS:
+        raise ValueError(f"Unknown card kind: {kind} (expected one of {', '.join(CARD_KINDS)})")
+    random.seed(seed)
+    photos = []
+    if kind in ('photo', 'mixed'):
+        photos = [ImageReader(_photo(seed * PHOTO_POOL + number)) for number in range(PHOTO_POOL)]
+
+    card_canvas = canvas.Canvas(path, pagesize=CARD_SIZE)
+    for index in range(pages):
+        design = start + (index % designs if designs else index)
+        card_kind = CARD_KINDS[design % 3] if kind == 'mixed' else kind
+        if card_kind == 'vector':
+            _draw_vector_card(card_canvas, design, random.Random(seed * 1000003 + design))
+        elif card_kind == 'photo':
+            _draw_photo_card(card_canvas, design, photos)
+        else:
+            _draw_text_card(card_canvas, design)
+        card_canvas.showPage()
+    card_canvas.save()
+    return path
@@ -0,0 +1,145 @@
+"""
+Sharded on-disk cache directory, shared by the raster and result caches
+
+Entries are files named by their key, in a subdirectory per first two hex
+digits of the key. The directory can be shared by several processes: entries
+are written to a temporary file and renamed into place, so readers never see a
+partial entry, and eviction runs under a lock file. Entries are evicted least
+recently used first (a hit refreshes the entry's mtime) once the directory
+grows past ``max_bytes``.
+"""
+
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction runs unlocked, which is still safe, just wasteful
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Eviction trims the cache to this fraction of max_bytes so it doesn't run on every store
+EVICT_TO = 0.9
+
+
+class DiskCache:
+    """Base class: entries at ``<directory>/<key[:2]>/<key><suffix>``, evicted LRU past ``max_bytes``
+
+    Subclasses set ``name`` (for log messages) and ``suffix``, and with
+    ``private`` the directory is created 0700 and must belong to the current
+    user. Instances hold no open files or locks, so they pickle.
+    """
+
+    name = 'Cache'
+    suffix = ''
+    private = False
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stores = 0
+        self.evictions = 0
+        # Bytes stored by this instance since it last checked the cache size
+        self._stored_since_check = 0
+        if self.private:
+            self._make_private(directory)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        self._stored_since_check = 0
+        with self._file_lock():
+            entries = []
+            total = 0
+            for path in self._entry_paths():
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            if total <= self.max_bytes:
+                return 0
+
+            removed = 0
+            target = self.max_bytes * EVICT_TO
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                if self._remove(path):
+                    total -= size
+                    removed += 1
+            self.evictions += removed
+            logger.info("%s: evicted %d entries", self.name, removed)
+            return removed
+
+    def _stored(self, nbytes):
+        """Count a stored entry of ``nbytes``, evicting once enough has been stored"""
+        self.stores += 1
+        self._stored_since_check += nbytes
+        # Checking the whole directory is a scan, so only do it after storing a
+        # tenth of the headroom left by the last eviction
+        if self._stored_since_check >= self.max_bytes * (1 - EVICT_TO):
+            self.evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _entry_paths(self, suffixes=None):
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(suffixes or self.suffix):
+                    yield entry.path
+
+    @contextmanager
+    def _temp_file(self, path):
+        """Yield a temporary path next to ``path``, renamed to it if the block succeeds"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            yield temp_path
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _make_private(self, directory):
+        """Create the directory 0700, or make sure an existing one is ours and closed to others"""
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not hasattr(os, 'getuid'):
+            # Windows: the temp directory is already per user
+            return
+        stat = os.stat(directory)
+        if stat.st_uid != os.getuid():
+            raise PermissionError(f"{self.name} directory {directory} belongs to another user")
+        if stat.st_mode & 0o077:
+            logger.warning("%s: closing %s to other users", self.name, directory)
+            os.chmod(directory, 0o700)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
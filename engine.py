@@ -0,0 +1,146 @@
+"""
+Conversion engine shared by the web apps and the batch converter
+
+Importing this module is cheap. It holds the settings that requests are
+validated against, and hands out process-wide PDFProcessor instances, one per
+combination of settings, built on first use and reused by every later job.
+The layout code itself (PyPDF2, ReportLab, Pillow, the raster backend) is only imported
+when the first processor is needed, so a web worker starts serving without it.
+
+``preload()`` does the imports up front: a server calls it once before it
+forks its workers (or before it starts serving), so no request pays for the
+imports and the forked workers share the loaded code. Given a processor's
+settings, it builds that processor too; a pre-forking server calls it
+without any, as its workers build their processors with the app's own
+settings. The time it took is recorded in the ``pdf_engine_load_seconds``
+gauge.
+"""
+
+import importlib
+import importlib.util
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import metrics
+import render_backends
+
+logger = logging.getLogger(__name__)
+
+# Render modes:
+#   auto   - vector imposition, falling back to raster if the input can't be imposed
+#   vector - vector imposition only
+#   raster - render every card to a 300 DPI image (legacy behaviour)
+RENDER_MODES = ('auto', 'vector', 'raster')
+
+# Raster quality profiles: the resolution, in DPI, of a card in its 96x128mm slot.
+# Cards are rendered straight to the slot's pixel size at that resolution.
+QUALITY_PROFILES = {
+    'draft': 150,
+    'print': 300,
+    'archive': 600,
+}
+DEFAULT_QUALITY = 'print'
+
+# A raster backend is only needed for the raster fallback; checked without importing it
+RASTER_BACKEND = render_backends.default_backend()
+PDF2IMAGE_AVAILABLE = 'poppler' in render_backends.available_backends()
+# What the raster path imports only when it's first used
+RASTER_IMPORTS = ('PIL.Image', 'reportlab.pdfgen.canvas', 'reportlab.lib.utils')
+
+_lock = threading.RLock()
+_processors = {}
+_raster_caches = {}
+_render_gates = {}
+_memory_budget = None
+
+
+def load():
+    """Import the layout code (once per process) and return the pdf_processor module"""
+    with _lock:
+        if 'pdf_processor' not in sys.modules:
+            start = time.perf_counter()
+            importlib.import_module('pdf_processor')
+            metrics.ENGINE_LOAD_SECONDS.set(time.perf_counter() - start)
+        return sys.modules['pdf_processor']
+
+
+def processor(**options):
+    """The process-wide PDFProcessor for these settings (PDFProcessor keyword arguments)
+
+    Built once and shared by every thread: a processor keeps each job's state
+    (stage times, last_job) per thread, so jobs can run on it concurrently.
+    """
+    key = tuple(sorted(options.items()))
+    with _lock:
+        shared = _processors.get(key)
+        if shared is None:
+            shared = _processors[key] = load().PDFProcessor(**options)
+        return shared
+
+
+def user_cache_dir(name):
+    """A directory called ``name`` under the system temp directory, for the current user only"""
+    if hasattr(os, 'getuid'):
+        name = f"{name}-{os.getuid()}"
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def raster_cache(directory, max_bytes=None):
+    """The process-wide RasterCache for ``directory`` (max_bytes None: the cache's default)"""
+    with _lock:
+        cache = _raster_caches.get(directory)
+        if cache is None:
+            # It's only ever wanted for a processor, and load() should be the one paying for PyPDF2
+            load()
+            from raster_cache import RasterCache, DEFAULT_MAX_BYTES
+            cache = _raster_caches[directory] = RasterCache(directory, max_bytes or DEFAULT_MAX_BYTES)
+        return cache
+
+
+def render_gate(slots=None, directory=None):
+    """The process-wide RenderGate over ``directory`` (None: the one every app of this user shares)
+
+    slots None: one per CPU.
+    """
+    from admission import RenderGate, DEFAULT_LOCK_DIR, DEFAULT_SLOTS
+    directory = directory or DEFAULT_LOCK_DIR
+    with _lock:
+        gate = _render_gates.get(directory)
+        if gate is None:
+            gate = _render_gates[directory] = RenderGate(slots or DEFAULT_SLOTS, directory)
+        return gate
+
+
+def memory_budget(max_bytes=None, timeout=None):
+    """The process-wide MemoryBudget (max_bytes None: the default; the first call's settings stick)"""
+    global _memory_budget
+    from admission import MemoryBudget, DEFAULT_MEMORY_BUDGET
+    with _lock:
+        if _memory_budget is None:
+            _memory_budget = MemoryBudget(max_bytes or DEFAULT_MEMORY_BUDGET, timeout)
+        return _memory_budget
+
+
+def preload(**options):
+    """Load the engine now, raster path included, and build the processor for ``options`` if any are given
+
+    Without options only the code is loaded: a processor built with default
+    settings would not be the one any job uses. Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    with _lock:
+        load()
+        for module in RASTER_IMPORTS:
+            importlib.import_module(module)
+        if RASTER_BACKEND is not None:
+            importlib.import_module(render_backends.BACKEND_MODULES[RASTER_BACKEND])
+        if options:
+            processor(**options)
+        seconds = time.perf_counter() - start
+        metrics.ENGINE_LOAD_SECONDS.set(seconds)
+    logger.info("Engine preloaded in %.3fs", seconds)
+    return seconds
@@ -0,0 +1,136 @@
+"""
+Imposition profiles
+
+A profile describes how cards are laid out on an output sheet: the sheet size,
+the card size, the grid (rows x cols), the gutters between cards and whether
+cards are turned a quarter to fit the grid. The grid is centred on the sheet.
+
+Slot positions are computed once per profile and shared by every job that uses
+it. ``auto_pack`` picks, for a profile's sheet, card and gutters, the grid and
+rotation that fit the most cards on a sheet.
+"""
+
+from collections import namedtuple
+from functools import cached_property, lru_cache
+
+from reportlab.lib.units import mm
+
+# Bottom-left corner of a slot on the sheet, in points
+Slot = namedtuple('Slot', 'x y')
+
+
+class ImpositionProfile:
+    """Sheet, card and grid geometry; sizes in millimetres, rows x cols of cards
+
+    With ``rotate``, cards are placed turned a quarter, so each slot is the
+    card's height wide and its width high (128x96mm cards in 96x128mm slots).
+    """
+
+    def __init__(self, name, sheet_size, card_size, rows, cols, gutter=(0, 0), rotate=False):
+        self.name = name
+        self.sheet_size = tuple(sheet_size)
+        self.card_size = tuple(card_size)
+        self.rows = rows
+        self.cols = cols
+        self.gutter = tuple(gutter)
+        self.rotate = rotate
+
+        if rows < 1 or cols < 1:
+            raise ValueError(f"Imposition profile {name}: needs at least one row and one column")
+        if self.grid_width > self.sheet_width or self.grid_height > self.sheet_height:
+            raise ValueError(
+                f"Imposition profile {name}: a {rows}x{cols} grid of "
+                f"{self.slot_width / mm:.0f}x{self.slot_height / mm:.0f}mm slots doesn't fit on a "
+                f"{self.sheet_size[0]:g}x{self.sheet_size[1]:g}mm sheet"
+            )
+
+    def __repr__(self):
+        return (f"ImpositionProfile({self.name!r}, sheet={self.sheet_size}, card={self.card_size}, "
+                f"{self.rows}x{self.cols}, gutter={self.gutter}, rotate={self.rotate})")
+
+    @property
+    def sheet_width(self):
+        return self.sheet_size[0] * mm
+
+    @property
+    def sheet_height(self):
+        return self.sheet_size[1] * mm
+
+    @property
+    def slot_width(self):
+        return (self.card_size[1] if self.rotate else self.card_size[0]) * mm
+
+    @property
+    def slot_height(self):
+        return (self.card_size[0] if self.rotate else self.card_size[1]) * mm
+
+    @property
+    def grid_width(self):
+        return self.cols * self.slot_width + (self.cols - 1) * self.gutter[0] * mm
+
+    @property
+    def grid_height(self):
+        return self.rows * self.slot_height + (self.rows - 1) * self.gutter[1] * mm
+
+    @property
+    def cards_per_sheet(self):
+        return self.rows * self.cols
+
+    @cached_property
+    def slots(self):
+        """Bottom-left corner of every slot, row by row from the top left"""
+        start_x = (self.sheet_width - self.grid_width) / 2
+        start_y = (self.sheet_height - self.grid_height) / 2
+        step_x = self.slot_width + self.gutter[0] * mm
+        step_y = self.slot_height + self.gutter[1] * mm
+        return tuple(
+            Slot(start_x + col * step_x, start_y + (self.rows - 1 - row) * step_y)
+            for row in range(self.rows)
+            for col in range(self.cols)
+        )
+
+
+def _grid_fit(sheet_length, slot_length, gutter):
+    """Number of slots (with gutters between them) that fit along one side of the sheet"""
+    return max(0, int((sheet_length + gutter) // (slot_length + gutter)))
+
+
+def auto_pack(profile):
+    """The profile's sheet, card and gutters with the grid that fits the most cards
+
+    Both card orientations are tried; on a tie the profile's own rotation wins.
+    """
+    best = None
+    for rotate in (profile.rotate, not profile.rotate):
+        card_width, card_height = profile.card_size
+        if rotate:
+            card_width, card_height = card_height, card_width
+        cols = _grid_fit(profile.sheet_size[0], card_width, profile.gutter[0])
+        rows = _grid_fit(profile.sheet_size[1], card_height, profile.gutter[1])
+        if rows * cols > (best[0] * best[1] if best else 0):
+            best = (rows, cols, rotate)
+    if best is None:
+        raise ValueError(f"Imposition profile {profile.name}: the card doesn't fit on the sheet")
+
+    rows, cols, rotate = best
+    return ImpositionProfile(f"{profile.name}-packed", profile.sheet_size, profile.card_size,
+                             rows, cols, profile.gutter, rotate)
+
+
+# 128x96mm ID cards, turned to portrait slots
+PROFILES = {
+    # The original layout: 2x2 on a 200x300mm sheet, cards touching
+    'default': ImpositionProfile('default', (200, 300), (128, 96), rows=2, cols=2, rotate=True),
+    'a4': ImpositionProfile('a4', (210, 297), (128, 96), rows=2, cols=2, gutter=(3, 3), rotate=True),
+    'a3': ImpositionProfile('a3', (297, 420), (128, 96), rows=3, cols=3, gutter=(3, 3), rotate=True),
+    'sra3': ImpositionProfile('sra3', (320, 450), (128, 96), rows=3, cols=3, gutter=(5, 5), rotate=True),
+}
+DEFAULT_PROFILE = 'default'
+
+
+@lru_cache(maxsize=None)
+def get_profile(name, packed=False):
+    """Look up a named profile (auto-packed if ``packed``); every caller shares one instance and its slot table"""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown imposition profile: {name} (expected one of {', '.join(PROFILES)})")
+    return auto_pack(PROFILES[name]) if packed else PROFILES[name]
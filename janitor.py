@@ -0,0 +1,145 @@
+"""
+Delayed file deletion from a single background thread
+
+Files are scheduled for deletion some time in the future (a download must be
+able to finish, and Windows won't delete a file that is still open). Instead
+of one sleeping thread per file, deletions sit in a time-ordered heap that one
+thread works through, sleeping until the earliest is due.
+
+Scheduling a file again replaces its earlier deadline. A file that can't be
+deleted yet (still locked) is retried a few times. ``rescan`` picks up files
+left behind by a previous run that crashed before deleting them.
+"""
+
+import fnmatch
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A locked file is retried this many times, this many seconds apart
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 30
+
+
+class Janitor:
+    def __init__(self, name='janitor'):
+        # (due, sequence, path) entries; an entry is stale once its path is rescheduled
+        self._heap = []
+        # path -> (due, attempts) of its live entry
+        self._pending = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, path, delay):
+        """Delete ``path`` in ``delay`` seconds (replacing any earlier schedule for it)"""
+        self._schedule(path, time.time() + delay, 0)
+
+    def cancel(self, path):
+        with self._condition:
+            self._pending.pop(path, None)
+            self._report()
+
+    def pending(self):
+        """Number of files waiting to be deleted"""
+        with self._condition:
+            return len(self._pending)
+
+    def rescan(self, directory, patterns, max_age):
+        """Schedule files in ``directory`` matching any of ``patterns`` for deletion once they are ``max_age`` seconds old
+
+        Meant for startup: files a crashed run never got to delete would
+        otherwise stay forever. Going by age leaves files that another process
+        is still using alone for a while.
+        """
+        found = 0
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            logger.warning("Janitor: could not scan %s: %s", directory, e)
+            return 0
+        for entry in entries:
+            if not any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                modified = entry.stat().st_mtime
+            except OSError:
+                continue
+            self._schedule(entry.path, modified + max_age, 0)
+            found += 1
+        if found:
+            logger.info("Janitor: scheduled %d leftover files in %s", found, directory)
+        return found
+
+    def close(self, wait=True):
+        """Stop the thread; pending deletions are dropped (rescan picks them up next time)"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if wait:
+            self._thread.join()
+
+    def _schedule(self, path, due, attempts):
+        with self._condition:
+            self._pending[path] = (due, attempts)
+            heapq.heappush(self._heap, (due, next(self._sequence), path))
+            self._report()
+            # Wake the thread in case this is now the earliest deadline
+            self._condition.notify()
+
+    def _report(self):
+        metrics.CLEANUP_PENDING.set(len(self._pending))
+
+    def _next_due(self):
+        """Wait for the earliest live deletion to come due and pop it; None once closed"""
+        with self._condition:
+            while not self._closed:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, _, path = self._heap[0]
+                entry = self._pending.get(path)
+                if entry is None or entry[0] != due:
+                    # Cancelled or rescheduled since
+                    heapq.heappop(self._heap)
+                    continue
+                delay = due - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._pending[path]
+                self._report()
+                return path, entry[1]
+            return None
+
+    def _run(self):
+        while True:
+            item = self._next_due()
+            if item is None:
+                return
+            path, attempts = item
+            try:
+                os.unlink(path)
+                logger.debug("Janitor: deleted %s", path)
+            except FileNotFoundError:
+                pass
+            except PermissionError as e:
+                # Still open somewhere (Windows locks open files)
+                if attempts + 1 < RETRY_ATTEMPTS:
+                    self._schedule(path, time.time() + RETRY_DELAY, attempts + 1)
+                else:
+                    logger.warning("Janitor: giving up on %s: %s", path, e)
+            except OSError as e:
+                logger.warning("Janitor: could not delete %s: %s", path, e)
@@ -0,0 +1,243 @@
+"""
+Background job queue
+
+Conversions run on a small pool of worker threads inside the web process, so
+requests return as soon as the upload is saved and no external broker is
+needed. Each job reports its state and progress, which the web app exposes at
+/jobs/<id>. Finished jobs are forgotten after ``retention`` seconds.
+
+Behind a server with several worker processes, a status request may reach a
+different process than the one running the job. Given a ``state_dir``, every
+job's state is also written to a small JSON file there, which the other
+processes read for jobs they don't know.
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_WORKERS = 2
+DEFAULT_RETENTION = 60 * 60
+
+# A running job's progress is written to its state file at most this often (seconds)
+PROGRESS_SAVE_INTERVAL = 1.0
+
+# Job ids come from URLs; only these can name a state file
+_JOB_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# What a state file holds
+_RECORD_FIELDS = ('id', 'state', 'done', 'total', 'result', 'error', 'created_at', 'started_at', 'finished_at')
+
+
+class Job:
+    def __init__(self, job_id, func, args):
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.state = QUEUED
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # When the job was last written to its state file
+        self.saved_at = 0.0
+
+    @classmethod
+    def from_record(cls, record):
+        """A read-only copy of a job from its state file"""
+        job = cls(record['id'], None, None)
+        for field in _RECORD_FIELDS:
+            setattr(job, field, record[field])
+        return job
+
+    def to_record(self):
+        return {field: getattr(self, field) for field in _RECORD_FIELDS}
+
+    def report_progress(self, done, total):
+        """Progress callback handed to the job function"""
+        self.done = done
+        self.total = total
+
+    def to_dict(self):
+        status = {
+            'job_id': self.id,
+            'state': self.state,
+            'progress': {'done': self.done, 'total': self.total},
+            'queued_seconds': round((self.started_at or time.time()) - self.created_at, 3),
+        }
+        if self.started_at is not None:
+            status['running_seconds'] = round((self.finished_at or time.time()) - self.started_at, 3)
+        if self.error is not None:
+            status['error'] = self.error
+        if self.result:
+            status.update(self.result)
+        return status
+
+
+class JobQueue:
+    """Run job functions on background worker threads
+
+    A job function is called as ``func(*args, progress=callback)``, where
+    ``callback(done, total)`` updates the job's progress. Whatever dict it
+    returns is merged into the job's status once it's done.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, retention=DEFAULT_RETENTION, state_dir=None):
+        self.retention = retention
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs = {}
+        # Jobs submitted and not finished yet (queued or running)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = []
+        for index in range(max(1, workers)):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{index + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, job_id=None):
+        """Queue ``func(*args)`` and return the new job's id"""
+        job = Job(job_id or str(uuid.uuid4()), func, args)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self._in_flight += 1
+        self._save(job)
+        self._queue.put(job)
+        return job.id
+
+    def complete(self, result, job_id=None):
+        """Record a job that is already done (e.g. answered from a cache) and return its id"""
+        job = Job(job_id or str(uuid.uuid4()), None, None)
+        job.state = DONE
+        job.result = result
+        job.started_at = job.finished_at = job.created_at
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._save(job)
+        return job.id
+
+    def status(self, job_id):
+        """Return a job's status as a dict, or None if it's unknown (or expired)
+
+        Jobs of other processes sharing the ``state_dir`` are found there.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        job = self._load(job_id)
+        return job.to_dict() if job is not None else None
+
+    def pending(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def in_flight(self):
+        """Number of jobs submitted to this queue that haven't finished (queued or running)"""
+        with self._lock:
+            return self._in_flight
+
+    def shutdown(self, wait=True):
+        """Stop the workers after the jobs already queued"""
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.state = RUNNING
+            job.started_at = time.time()
+            metrics.QUEUE_WAIT_SECONDS.observe(job.started_at - job.created_at)
+            self._save(job)
+            try:
+                job.result = job.func(*job.args, progress=lambda done, total: self._report_progress(job, done, total))
+                job.state = DONE
+            except Exception as e:
+                logger.exception("Job %s failed", job.id)
+                job.error = str(e)
+                job.state = FAILED
+            finally:
+                job.finished_at = time.time()
+                job.func = job.args = None
+                self._save(job)
+                with self._lock:
+                    self._in_flight -= 1
+                logger.info("Job %s %s: queued=%.3fs running=%.3fs", job.id, job.state,
+                            job.started_at - job.created_at, job.finished_at - job.started_at)
+
+    def _report_progress(self, job, done, total):
+        job.report_progress(done, total)
+        if self.state_dir is not None and time.time() - job.saved_at >= PROGRESS_SAVE_INTERVAL:
+            self._save(job)
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        """Write a job's state file, replacing the previous one in one step"""
+        if self.state_dir is None:
+            return
+        job.saved_at = time.time()
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as state_file:
+                json.dump(job.to_record(), state_file)
+            os.replace(temp_path, self._state_path(job.id))
+        except (OSError, TypeError, ValueError) as e:
+            # Only other processes lose sight of the job
+            logger.warning("Could not save the state of job %s: %s", job.id, e)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _load(self, job_id):
+        if self.state_dir is None or not _JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id)) as state_file:
+                job = Job.from_record(json.load(state_file))
+        except (OSError, ValueError, KeyError):
+            return None
+        if job.finished_at is not None and job.finished_at < time.time() - self.retention:
+            return None
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+            if self.state_dir is not None:
+                try:
+                    os.remove(self._state_path(job_id))
+                except OSError:
+                    pass
@@ -0,0 +1,168 @@
+"""
+Process-wide conversion metrics in the Prometheus text exposition format
+
+A minimal registry of counters, gauges and histograms, so the app can expose
+/metrics without depending on prometheus_client. The layout pipeline records
+each job's stage times and page count here; the job queue records how long
+jobs waited for a worker, and the result cache its hits and misses.
+
+Metrics live in this process only: behind a server with several worker
+processes, every process reports its own.
+"""
+
+import math
+import threading
+
+# Upper bounds (seconds) for stage, job and queue-wait histograms
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Upper bounds for the pages-per-job histogram
+PAGES_BUCKETS = (1, 4, 16, 64, 256, 1024, 4096)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            lines.extend(self._render_series(key, value) for key, value in series)
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * len(self.buckets)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._series[key] = (counts, total + value)
+
+    def _render_series(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return '\n'.join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Every registered metric in the Prometheus text format"""
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'pdf_stage_seconds', 'Time a conversion job spent in each pipeline stage', labels=('stage',)))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    'pdf_job_seconds', 'Time to lay out a whole conversion job', labels=('mode',)))
+JOB_PAGES = REGISTRY.register(Histogram(
+    'pdf_job_pages', 'Input pages per conversion job', buckets=PAGES_BUCKETS))
+JOBS = REGISTRY.register(Counter(
+    'pdf_jobs_total', 'Conversion jobs by layout path (vector, raster or fallback)', labels=('mode',)))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'pdf_queue_wait_seconds', 'Time jobs waited in the queue for a worker'))
+QUEUE_PENDING = REGISTRY.register(Gauge(
+    'pdf_queue_pending_jobs', 'Jobs waiting in the queue for a worker'))
+JOBS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'pdf_jobs_in_flight', 'Conversions accepted by this process and not finished (queued, running or streaming)'))
+REQUESTS_REJECTED = REGISTRY.register(Counter(
+    'pdf_requests_rejected_total', 'Conversion requests refused with 429 because too many were in flight',
+    labels=('endpoint',)))
+RENDER_SLOT_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'pdf_render_slot_wait_seconds', 'Time renders waited for a render slot (a poppler process)'))
+MEMORY_RESERVED_BYTES = REGISTRY.register(Gauge(
+    'pdf_memory_reserved_bytes', 'Raster memory reserved by the jobs running in this process'))
+ENGINE_LOAD_SECONDS = REGISTRY.register(Gauge(
+    'pdf_engine_load_seconds', 'Time this process spent loading the conversion engine'))
+CLEANUP_PENDING = REGISTRY.register(Gauge(
+    'pdf_cleanup_pending_files', 'Files scheduled for deletion by the janitor'))
+RESULT_CACHE_REQUESTS = REGISTRY.register(Counter(
+    'pdf_result_cache_requests_total',
+    'Conversion requests answered from the result cache (hit), by a job already converting the same '
+    'upload (coalesced), or by a new job (miss)', labels=('outcome',)))
+
+
+def observe_job(mode, pages, seconds, stage_times):
+    """Record one finished layout job"""
+    JOBS.inc(mode=mode)
+    JOB_PAGES.observe(pages)
+    JOB_SECONDS.observe(seconds, mode=mode)
+    for stage, stage_seconds in stage_times.items():
+        STAGE_SECONDS.observe(stage_seconds, stage=stage)
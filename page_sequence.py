@@ -0,0 +1,64 @@
+"""
+Page sequence over several PDFs
+
+A merge job lays out the pages of every uploaded PDF as if they were one
+document. PageSequence opens each input once and maps a global page index to
+(document, local page index), so the layout pipeline reads pages straight from
+the original readers instead of from a merged copy written to disk and parsed
+again.
+"""
+
+import io
+from bisect import bisect_right
+
+import PyPDF2
+
+
+class PageSequence:
+    """The pages of one or more PDF sources, in order, addressed by one global index
+
+    Sources are paths or PDFs as bytes. Paths are opened with ``stack`` (an
+    ExitStack) and stay open until it closes; PyPDF2 reads objects from the
+    file lazily.
+    """
+
+    def __init__(self, sources, stack):
+        self.sources = list(sources)
+        self.readers = []
+        # Global index of the first page of each document, plus the total page count
+        self._starts = [0]
+        for source in self.sources:
+            if isinstance(source, str):
+                stream = stack.enter_context(open(source, 'rb'))
+            else:
+                stream = io.BytesIO(source)
+            reader = PyPDF2.PdfReader(stream)
+            self.readers.append(reader)
+            self._starts.append(self._starts[-1] + len(reader.pages))
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __getitem__(self, index):
+        document, local_index = self.locate(index)
+        return self.readers[document].pages[local_index]
+
+    def __iter__(self):
+        for reader in self.readers:
+            yield from reader.pages
+
+    @property
+    def is_encrypted(self):
+        return any(reader.is_encrypted for reader in self.readers)
+
+    def locate(self, index):
+        """Map a global page index to (document index, page index within that document)"""
+        if not 0 <= index < len(self):
+            raise IndexError(f"page index {index} out of range")
+        document = bisect_right(self._starts, index) - 1
+        return document, index - self._starts[document]
+
+    def source_of(self, index):
+        """The source (path or bytes) and local page index of a global page index"""
+        document, local_index = self.locate(index)
+        return self.sources[document], local_index
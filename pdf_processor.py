@@ -1,202 +1,1085 @@
 import PyPDF2
-from reportlab.lib.pagesizes import A4
+from PyPDF2 import Transformation
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
 from reportlab.lib.units import mm
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from PIL import Image
+import hashlib
 import io
+import logging
 import tempfile
+import threading
 import os
-from pdf2image import convert_from_path
+import time
+import zlib
+from collections import deque, namedtuple
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import lru_cache
+from concurrent.futures import Future
+
+import metrics
+from admission import AdmissionError
+from engine import DEFAULT_QUALITY, QUALITY_PROFILES, RENDER_MODES
+from imposition import DEFAULT_PROFILE, ImpositionProfile, auto_pack as pack_profile, get_profile
+from page_sequence import PageSequence
+from pdf_stream import ChunkStream, IncrementalPdfWriter, SharedObject
+from raster_cache import page_digest
+from render_backends import BACKENDS as RENDER_BACKENDS, available_backends, default_backend, get_backend
+
+logger = logging.getLogger(__name__)
+
+# A raster backend (render_backends.py) is only needed for the raster fallback. It,
+# Pillow and ReportLab's canvas are imported where the raster path uses them, so
+# vector-only work never loads them; engine.preload() loads them up front.
+if not available_backends():
+    logger.warning("No raster backend available, raster fallback disabled. "
+                   "Install with: pip install pypdfium2 (or pdf2image and poppler)")
+
+# Raster path: pages rendered per poppler call (the pipeline's memory window,
+# four sheets of the default profile), and poppler threads per call
+RASTER_BATCH_PAGES = 16
+RASTER_THREADS = os.cpu_count() or 1
+
+# Slot placements remembered per process, by page box, /Rotate, slot and slot size;
+# a job's cards nearly always share one box, so a few profiles' worth is plenty
+SLOT_MATRIX_CACHE_SIZE = 256
+
+# Rendered cards are RGB: the memory a raster job is admitted for is pixels times this
+RASTER_BYTES_PER_PIXEL = 3
+
+# How rendered cards are embedded:
+#   flate - deflate the raw pixels at ``flate_level`` and embed them as-is (/FlateDecode);
+#           lossless, and encoded in the render workers (the default)
+#   jpeg  - encode as JPEG at ``jpeg_quality`` and embed the bytes as-is (/DCTDecode)
+#   pil   - hand the decoded image straight to ReportLab, which deflates it itself while
+#           drawing the sheet (kept for compatibility; opt in with ``codec='pil'``)
+# ReportLab always compresses at zlib's default level and wraps images in ASCII85,
+# so pre-encoded cards are added to the sheet as image XObjects instead.
+RASTER_CODECS = ('pil', 'jpeg', 'flate')
+DEFAULT_CODEC = 'flate'
+JPEG_QUALITY = 90
+FLATE_LEVEL = 6
+
+# With depth reduction, every rendered card is classified by its pixels and embedded
+# at the smallest depth that holds them exactly:
+#   color   - 24-bit RGB, as rendered
+#   gray    - every pixel has R == G == B: 8-bit gray (a third of the pixel data)
+#   bilevel - gray, and only black and white: 1-bit gray, deflated whatever the codec
+#             (a twenty-fourth; JPEG would only blur its edges)
+CARD_DEPTHS = ('color', 'gray', 'bilevel')
+# A card's depth is first checked on every this many'th pixel each way, so most color
+# cards (and anti-aliased gray ones) skip the full-size checks
+DEPTH_PROBE_FACTOR = 8
+# Maps every gray level but black and white to nonzero
+_MIDTONES = [0] + [255] * 254 + [0]
+
+# A card encoded in a render worker, ready to embed without decoding
+EncodedCard = namedtuple('EncodedCard', 'filter width height color_space data bits_per_component',
+                         defaults=(8,))
+
+# Pixel size to render a page at, and whether to turn it a quarter (counter-clockwise)
+# afterwards to match the slot's orientation
+RenderTarget = namedtuple('RenderTarget', 'width height turn')
+
+# Stands in for the card of a page identical to an earlier page of the same job
+DUPLICATE_CARD = object()
+
+# Vector imposition draws a page's annotations (form fields, stamps, ...) from their
+# normal appearance streams. Annotation flags (PDF 32000-1, 12.5.3) that keep one off
+# the page, and the subtypes that draw nothing themselves:
+ANNOT_HIDDEN = 1 << 1
+ANNOT_NO_VIEW = 1 << 5
+NON_DRAWING_ANNOTS = ('/Link', '/Popup')
+
+
+def _chunks(items, size, first_size=None):
+    """Group an iterable into lists of at most ``size`` items (``first_size`` for the first), lazily"""
+    chunk = []
+    limit = first_size or size
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == limit:
+            yield chunk
+            chunk = []
+            limit = size
+    if chunk:
+        yield chunk
+
+
+class StageTimer:
+    """Wall time a job spends in each stage of the layout pipeline
+
+    The pipeline is a chain of generators, each pulling from the one before it,
+    so every stage is timed exclusive of the stages it pulls from: the time a
+    compose step spends waiting for its next card is charged to rendering.
+    """
 
-class PDFProcessor:
     def __init__(self):
-        # Source PDF dimensions (128mm x 96mm) - but we want output to be 96mm x 128mm
-        self.source_width = 128 * mm
-        self.source_height = 96 * mm
-        
-        # Output layout dimensions (96mm x 128mm each)
-        self.layout_width = 96 * mm
-        self.layout_height = 128 * mm
-        
-        # Custom page dimensions (200mm x 300mm portrait)
-        self.page_width = 200 * mm
-        self.page_height = 300 * mm
-        
-        # Calculate total area needed for 2x2 grid (no spacing, layouts touch each other)
-        self.total_width = self.layout_width * 2  # 2 columns
-        self.total_height = self.layout_height * 2  # 2 rows
-        
-        # Calculate center position on custom page
+        self.totals = {}
+        self._stack = []
+        self._since = None
+
+    @contextmanager
+    def stage(self, name):
+        """Charge the time spent in the block to ``name``"""
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(now)
+        self._stack.append(name)
+        self._since = now
+        try:
+            yield
+        finally:
+            self._charge(time.perf_counter())
+            self._stack.pop()
+
+    def iterate(self, name, iterable):
+        """Yield from ``iterable``, charging the time spent producing each item to ``name``"""
+        iterator = iter(iterable)
+        try:
+            while True:
+                with self.stage(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def add(self, name, seconds):
+        """Charge time measured elsewhere (e.g. in a render worker) to ``name``"""
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    def _charge(self, now):
+        self.add(self._stack[-1], now - self._since)
+        self._since = now
+
+
+def card_depth(img):
+    """Classify a rendered card as color, gray or bilevel; returns (depth, image at that depth)
+
+    Only whole-image Pillow operations, no per-pixel Python: gray needs the
+    differences between the channels to be zero everywhere, bilevel a gray
+    histogram that is empty between black and white. Both are first checked
+    on an evenly spaced sample of the pixels, which settles most cards (a
+    color or gray pixel in the sample is one in the card). The bilevel image
+    is still 8-bit (only 0 and 255); encode_card() packs it.
+    """
+    from PIL import Image, ImageChops
+
+    def is_gray(rgb):
+        red, green, blue = rgb.split()
+        return not (ImageChops.difference(red, green).getbbox() or ImageChops.difference(green, blue).getbbox())
+
+    if img.mode not in ('RGB', 'L'):
+        return 'color', img.convert('RGB')
+    sample = img.resize((max(1, img.width // DEPTH_PROBE_FACTOR), max(1, img.height // DEPTH_PROBE_FACTOR)),
+                        Image.Resampling.NEAREST)
+    if img.mode == 'RGB':
+        if not is_gray(sample) or not is_gray(img):
+            return 'color', img
+        img, sample = img.getchannel('G'), sample.getchannel('G')
+    if any(sample.histogram()[1:255]) or img.point(_MIDTONES).getbbox():
+        return 'gray', img
+    return 'bilevel', img
+
+
+def encode_card(img, codec=DEFAULT_CODEC, jpeg_quality=JPEG_QUALITY, flate_level=FLATE_LEVEL, reduce_depth=True):
+    """Encode a rendered card for embedding
+
+    Returns an EncodedCard holding the compressed pixel data, or for the
+    ``pil`` codec the decoded image itself. With ``reduce_depth``, a
+    gray card is embedded as 8-bit gray and a bilevel one as 1-bit Flate (see
+    CARD_DEPTHS).
+    """
+    if reduce_depth:
+        depth, img = card_depth(img)
+        if depth == 'bilevel':
+            from PIL import Image
+            # Exact: the pixels are already 0 or 255. Packed 8 to a byte, rows padded
+            # to whole bytes and 1 for white, as PDF's 1-bit /DeviceGray wants them
+            bits = img.convert('1', dither=Image.Dither.NONE).tobytes()
+            return EncodedCard('/FlateDecode', img.width, img.height, '/DeviceGray',
+                               zlib.compress(bits, flate_level), 1)
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if codec == 'pil':
+        # Image.open() is lazy; load the pixels before the rendered file goes away
+        img.load()
+        return img
+
+    color_space = '/DeviceGray' if img.mode == 'L' else '/DeviceRGB'
+    if codec == 'jpeg':
+        img_buffer = io.BytesIO()
+        img.save(img_buffer, format='JPEG', quality=jpeg_quality)
+        return EncodedCard('/DCTDecode', img.width, img.height, color_space, img_buffer.getvalue())
+    if codec == 'flate':
+        data = zlib.compress(img.tobytes(), flate_level)
+        return EncodedCard('/FlateDecode', img.width, img.height, color_space, data)
+    raise ValueError(f"Unknown raster codec: {codec}")
+
+
+def _orient(img, target):
+    """Turn a rendered page into the slot's orientation if its target says so"""
+    if target is not None and target.turn:
+        from PIL import Image
+        return img.transpose(Image.Transpose.ROTATE_90)
+    return img
+
+
+def render_page_range(pdf_source, first_page, last_page, output_folder, thread_count=1, target=None,
+                      codec=DEFAULT_CODEC, jpeg_quality=JPEG_QUALITY, flate_level=FLATE_LEVEL, reduce_depth=True,
+                      raster_cache=None, cache_keys=None, render_gate=None, render_backend=None):
+    """Render a page range with one backend call and return one encoded card per page
+
+    ``pdf_source`` is a path or the PDF itself as bytes. Every page is rendered
+    at ``target``'s pixel size, or at the default profile's DPI if it's None,
+    by the named backend (None: the default one). A backend that writes files
+    (poppler) uses ``output_folder``, or its output pipe when it is None.
+    Module-level so it can run in a ProcessPoolExecutor worker. Returns the
+    cards, with None for a page that could not be rendered, and the seconds
+    spent encoding them. With a raster cache, each card is stored under the
+    matching entry of ``cache_keys`` as soon as it's encoded. With a
+    RenderGate, the render waits for a slot, and a threaded backend uses at
+    most as many threads as it was granted slots.
+    """
+    expected = last_page - first_page + 1
+    backend = get_backend(render_backend)
+    wanted = thread_count if backend.threaded else 1
+    # A gate that can't be held (e.g. a lock directory we may not write) fails the
+    # job; only the render itself failing leaves placeholders
+    with render_gate.hold(wanted) if render_gate is not None else nullcontext(wanted) as thread_count:
+        try:
+            images = backend.render(
+                pdf_source,
+                first_page,
+                last_page,
+                size=(target.width, target.height) if target is not None else None,
+                dpi=QUALITY_PROFILES[DEFAULT_QUALITY],
+                output_folder=output_folder,
+                thread_count=thread_count,
+            )
+        except Exception as e:
+            logger.warning("Image conversion error for pages %d-%d: %s", first_page, last_page, e)
+            return [None] * expected, 0.0
+    logger.debug("Rendered pages %d-%d (%d images)", first_page, last_page, len(images))
+
+    if len(images) != expected:
+        logger.warning("Expected %d rendered pages, got %d", expected, len(images))
+        for image in images:
+            if isinstance(image, str):
+                os.unlink(image)
+        return [None] * expected, 0.0
+
+    cards = []
+    encode_seconds = 0.0
+    for index, image in enumerate(images):
+        start = time.perf_counter()
+        if isinstance(image, str):
+            from PIL import Image
+            try:
+                with Image.open(image) as img:
+                    card = encode_card(_orient(img, target), codec, jpeg_quality, flate_level, reduce_depth)
+            finally:
+                os.unlink(image)
+        else:
+            card = encode_card(_orient(image, target), codec, jpeg_quality, flate_level, reduce_depth)
+            images[index] = None
+        encode_seconds += time.perf_counter() - start
+        cards.append(card)
+
+        if raster_cache is not None:
+            try:
+                raster_cache.put(cache_keys[index], card)
+            except Exception as e:
+                logger.warning("Raster cache: could not store page %d: %s", first_page + index, e)
+    return cards, encode_seconds
+
+
+@lru_cache(maxsize=SLOT_MATRIX_CACHE_SIZE)
+def _placement_matrix(box, rotation, slot, slot_size):
+    """The ``cm`` operands scaling, rotating and translating a page into a slot
+
+    ``box`` is the page's crop box (left, bottom, right, top) and ``rotation``
+    its /Rotate (clockwise); ``slot`` is the slot's bottom-left corner and
+    ``slot_size`` its (width, height).
+    """
+    left, bottom, right, top = box
+    width = right - left
+    height = top - bottom
+    slot_width, slot_height = slot_size
+
+    # Honour /Rotate, then turn the card a quarter if its orientation doesn't
+    # match the slot (128x96 landscape into 96x128 portrait)
+    angle = -rotation
+    if rotation in (90, 270):
+        width, height = height, width
+    if (width > height) != (slot_width > slot_height):
+        angle += 90
+        width, height = height, width
+
+    scale = min(slot_width / width, slot_height / height)
+    ctm = (
+        Transformation()
+        .translate(-(left + right) / 2, -(bottom + top) / 2)
+        .rotate(angle)
+        .scale(scale, scale)
+        .translate(slot[0] + slot_width / 2, slot[1] + slot_height / 2)
+    ).ctm
+    return " ".join(f"{v:.4f}" for v in ctm)
+
+class PDFProcessor:
+    def __init__(self, render_mode='auto', raster_threads=RASTER_THREADS, raster_batch_pages=RASTER_BATCH_PAGES,
+                 workers=1, codec=DEFAULT_CODEC, jpeg_quality=JPEG_QUALITY, flate_level=FLATE_LEVEL, raster_cache=None,
+                 quality=DEFAULT_QUALITY, imposition=DEFAULT_PROFILE, auto_pack=False,
+                 render_gate=None, memory_budget=None, render_backend=None, reduce_depth=True):
+        if render_mode not in RENDER_MODES:
+            raise ValueError(f"Unknown render mode: {render_mode} (expected one of {', '.join(RENDER_MODES)})")
+        if quality not in QUALITY_PROFILES:
+            raise ValueError(f"Unknown quality profile: {quality} (expected one of {', '.join(QUALITY_PROFILES)})")
+        if render_backend is not None and render_backend not in RENDER_BACKENDS:
+            raise ValueError(f"Unknown render backend: {render_backend} (expected one of {', '.join(RENDER_BACKENDS)})")
+        if codec not in RASTER_CODECS:
+            raise ValueError(f"Unknown raster codec: {codec} (expected one of {', '.join(RASTER_CODECS)})")
+        if not 1 <= jpeg_quality <= 100:
+            raise ValueError(f"JPEG quality must be between 1 and 100, got {jpeg_quality}")
+        if not 0 <= flate_level <= 9:
+            raise ValueError(f"Flate level must be between 0 and 9, got {flate_level}")
+        self.render_mode = render_mode
+        self.raster_threads = max(1, raster_threads)
+        self.raster_batch_pages = max(1, raster_batch_pages)
+        # Number of processes rendering cards in parallel (1 = render in this process)
+        self.workers = max(1, workers)
+        self.codec = codec
+        self.jpeg_quality = jpeg_quality
+        self.flate_level = flate_level
+        # Embed gray and bilevel cards at 8 and 1 bits per pixel instead of 24
+        self.reduce_depth = reduce_depth
+        # Optional RasterCache shared with other jobs and processes
+        self.raster_cache = raster_cache
+        # Optional admission control (admission.py): a RenderGate capping concurrent
+        # renders, and a MemoryBudget the raster stage of a job must fit in
+        self.render_gate = render_gate
+        self.memory_budget = memory_budget
+        # Raster backend (render_backends.py); None picks the first one installed
+        self.render_backend = render_backend or default_backend()
+        # Raster resolution; vector imposition is resolution independent
+        self.quality = quality
+        self.dpi = QUALITY_PROFILES[quality]
+        # Per-job state (stage timings, last_job) is kept per thread, so one
+        # processor can run jobs on several threads at once
+        self._job_state = threading.local()
+
+        # Sheet geometry: a named imposition profile (or an ImpositionProfile),
+        # optionally re-gridded to fit the most cards on its sheet
+        if not isinstance(imposition, ImpositionProfile):
+            imposition = get_profile(imposition, auto_pack)
+        elif auto_pack:
+            imposition = pack_profile(imposition)
+        self.imposition = imposition
+        self.cards_per_sheet = imposition.cards_per_sheet
+        # Source card dimensions (128mm x 96mm), turned to fit the slot if the profile rotates cards
+        self.source_width = imposition.card_size[0] * mm
+        self.source_height = imposition.card_size[1] * mm
+
+        # Output layout dimensions (one slot, 96mm x 128mm by default)
+        self.layout_width = imposition.slot_width
+        self.layout_height = imposition.slot_height
+
+        # Sheet dimensions (200mm x 300mm portrait by default)
+        self.page_width = imposition.sheet_width
+        self.page_height = imposition.sheet_height
+
+        # Area taken by the grid of slots and their gutters, centred on the sheet
+        self.total_width = imposition.grid_width
+        self.total_height = imposition.grid_height
         self.start_x = (self.page_width - self.total_width) / 2
         self.start_y = (self.page_height - self.total_height) / 2
-        
-        # Scale factor to fit source PDF (128x96) into layout (96x128)
-        # We need to rotate and scale
-        self.scale_x = self.layout_width / self.source_width  # 96/128 = 0.75
-        self.scale_y = self.layout_height / self.source_height  # 128/96 = 1.33
-        self.scale = min(self.scale_x, self.scale_y)  # Use 0.75 to maintain aspect ratio
-        
+
+        # Scale factor to fit a source card into its slot, once rotated (96/128 = 0.75 by default)
+        if imposition.rotate:
+            self.scale = min(self.layout_width / self.source_height, self.layout_height / self.source_width)
+        else:
+            self.scale = min(self.layout_width / self.source_width, self.layout_height / self.source_height)
+
         # Calculate final scaled dimensions
         self.final_width = self.source_width * self.scale
         self.final_height = self.source_height * self.scale
-        
-        print(f"Page dimensions: {self.page_width/mm:.1f}mm x {self.page_height/mm:.1f}mm")
-        print(f"Layout dimensions: {self.layout_width/mm:.1f}mm x {self.layout_height/mm:.1f}mm")
-        print(f"Total grid area: {self.total_width/mm:.1f}mm x {self.total_height/mm:.1f}mm")
-        print(f"Start position: ({self.start_x/mm:.1f}mm, {self.start_y/mm:.1f}mm)")
-        print(f"Scale factor: {self.scale:.3f}")
-
-    def merge_and_process_pdfs(self, input_paths, output_path):
-        """Merge multiple PDFs into a single PDF and process with existing layout."""
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Layout %s: page %.1fx%.1fmm, %dx%d slots of %.1fx%.1fmm, grid %.1fx%.1fmm at (%.1fmm, %.1fmm), "
+                "scale %.3f", self.imposition.name, self.page_width / mm, self.page_height / mm,
+                self.imposition.rows, self.imposition.cols, self.layout_width / mm, self.layout_height / mm,
+                self.total_width / mm, self.total_height / mm, self.start_x / mm, self.start_y / mm, self.scale,
+            )
+            logger.debug(
+                "Settings: render_mode=%s workers=%d codec=%s quality=%s dpi=%d raster_cache=%s",
+                self.render_mode, self.workers, self._codec_label(), self.quality, self.dpi,
+                self.raster_cache.directory if self.raster_cache is not None else None,
+            )
+
+    def _codec_label(self):
+        if self.codec == 'jpeg':
+            return f"jpeg (quality {self.jpeg_quality})"
+        if self.codec == 'flate':
+            return f"flate (level {self.flate_level})"
+        return self.codec
+
+    @property
+    def _timer(self):
+        """Stage timer of the job running on (or last run by) this thread"""
+        timer = getattr(self._job_state, 'timer', None)
+        if timer is None:
+            timer = self._job_state.timer = StageTimer()
+        return timer
+
+    @_timer.setter
+    def _timer(self, timer):
+        self._job_state.timer = timer
+
+    @property
+    def last_job(self):
+        """Layout path, page count and seconds of the last job this thread ran (None before the first)"""
+        return getattr(self._job_state, 'last_job', None)
+
+    @property
+    def stage_times(self):
+        """Seconds the last job spent in each pipeline stage
+
+        Stages are ``parse`` (opening the inputs), ``admit`` (waiting for room
+        in the memory budget), ``render`` (rendering cards, waiting for render
+        slots or for the render workers), ``encode`` (encoding rendered cards;
+        part of ``render`` unless it ran in a worker), ``draw`` (composing
+        sheets) and ``save`` (writing them out).
+        """
+        return dict(self._timer.totals)
+
+    def raster_memory_estimate(self, page_count):
+        """Bytes of pixels a raster job of ``page_count`` pages holds at once, at this profile's DPI
+
+        The pipeline renders one window of pages at a time (two per worker with
+        render workers), so the estimate grows with pages only up to a window.
+        """
+        window = self.raster_batch_pages * (1 if self.workers == 1 else 2 * self.workers)
+        pixels = round(self.layout_width / 72 * self.dpi) * round(self.layout_height / 72 * self.dpi)
+        return min(page_count, window) * pixels * RASTER_BYTES_PER_PIXEL
+
+    @property
+    def _codec_args(self):
+        return self.codec, self.jpeg_quality, self.flate_level, self.reduce_depth
+
+    def merge_and_process_pdfs(self, input_paths, output_path, progress=None):
+        """Lay out the pages of several PDFs, in order, as if they were one document
+
+        The inputs are read in place through a PageSequence; nothing is merged
+        into an intermediate PDF first.
+        """
+        self._process([path for path in input_paths if os.path.exists(path)], output_path, progress)
+
+    def merge_and_process_pdf_bytes(self, pdf_datas, progress=None):
+        """In-memory counterpart of merge_and_process_pdfs: PDFs as bytes in, the output PDF as bytes out"""
+        output = io.BytesIO()
+        self._process(list(pdf_datas), output, progress)
+        return output.getvalue()
+
+    def process_pdf(self, input_path, output_path, progress=None):
+        """Process PDF and lay its cards out on sheets, as the imposition profile says
+
+        ``progress(done, total)``, if given, is called with the number of cards
+        laid out so far after every output sheet.
+        """
+        self._process([input_path], output_path, progress)
+
+    def process_pdf_bytes(self, pdf_data, progress=None):
+        """In-memory counterpart of process_pdf: the input PDF as bytes in, the output PDF as bytes out
+
+        The input is parsed from a BytesIO, sheets are written to a BytesIO, and
+        rendered cards come back from the backend in memory (poppler's over a
+        pipe). With poppler the raster path still costs one temporary file:
+        pdf2image hands poppler a copy of the input.
+        """
+        output = io.BytesIO()
+        self._process([pdf_data], output, progress)
+        return output.getvalue()
+
+    def stream_pdf(self, source, progress=None):
+        """Lay out ``source`` (a path or bytes) and yield the output PDF in chunks
+
+        The layout runs on a background thread and every sheet is yielded as
+        soon as it has been written, so the first bytes are available long
+        before the job is done; the page tree, xref table and trailer come last.
+        If the job fails after the first sheet was yielded, the error is raised
+        from the iterator, since output that was already sent can't be replaced
+        with the fallback layout. The job runs on another thread, so its
+        stage_times and last_job are not this thread's.
+        """
+        stream = ChunkStream()
+        return stream.run(self._process, [source], stream, progress)
+
+    def _process(self, sources, output, progress):
+        """Lay out the pages of ``sources`` (paths or bytes) into ``output`` (a path or a binary stream)"""
+        self._timer = StageTimer()
+        start = time.perf_counter()
+        total_pages = 0
         try:
-            # Create temporary merged input
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_merged:
-                merged_path = temp_merged.name
+            # Parse every input once; both layout paths share these readers and their page objects
+            with ExitStack() as stack:
+                with self._timer.stage('parse'):
+                    pages = PageSequence(sources, stack)
+                total_pages = len(pages)
+                logger.debug("Laying out %d pages from %d inputs", total_pages, len(sources))
+
+                mode = 'raster'
+                if self.render_mode in ('auto', 'vector'):
+                    try:
+                        self._process_pdf_vector(pages, output, progress)
+                        mode = 'vector'
+                    except Exception as e:
+                        if self.render_mode == 'vector':
+                            raise
+                        logger.info("Vector imposition not possible, falling back to raster: %s", e)
 
-            merger = PyPDF2.PdfWriter()
+                if mode == 'raster':
+                    self._process_pdf_raster(pages, output, progress)
+
+        except AdmissionError:
+            # Not a layout failure: the job was never let in, so there's nothing to fall back from
+            raise
+        except Exception as e:
+            logger.warning("Layout failed, writing the fallback layout instead: %s", e)
+            mode = 'fallback'
+            self._create_fallback_layout(sources, output)
 
-            # Append pages from all inputs in order
-            for path in input_paths:
-                if not os.path.exists(path):
+        seconds = time.perf_counter() - start
+        stage_times = self.stage_times
+        self._job_state.last_job = {'mode': mode, 'pages': total_pages, 'seconds': seconds}
+        metrics.observe_job(mode, total_pages, seconds, stage_times)
+        logger.info(
+            "Job done: mode=%s pages=%d seconds=%.3f %s", mode, total_pages, seconds,
+            " ".join(f"{stage}={stage_seconds:.3f}" for stage, stage_seconds in stage_times.items()),
+        )
+
+    @staticmethod
+    @contextmanager
+    def _output_file(output):
+        """Open an output path for writing, or start an output stream over"""
+        if isinstance(output, str):
+            with open(output, 'wb') as output_file:
+                yield output_file
+        else:
+            output.seek(0)
+            output.truncate()
+            yield output
+
+    def _slot_position(self, layout_pos):
+        """Return the bottom-left corner of a slot, from the profile's slot table"""
+        return self.imposition.slots[layout_pos]
+
+    def _process_pdf_vector(self, pages, output, progress=None):
+        """Impose source pages as form XObjects so text and vector art stay vector"""
+        if pages.is_encrypted:
+            raise ValueError("input PDF is encrypted")
+        for reader in pages.readers:
+            acro_form = reader.trailer['/Root'].get('/AcroForm')
+            if acro_form is not None and acro_form.get_object().get('/NeedAppearances'):
+                # The field values are only drawn once a renderer regenerates their appearances
+                raise ValueError("form fields need their appearances generated")
+        # Every page is checked before the first sheet is written: a streamed
+        # response can't be rewound for the raster retry once sheets have gone out
+        for page in pages:
+            self._annotation_appearances(page)
+
+        sheets = self._timer.iterate('draw', self._compose_vector_sheets(self._page_source(pages)))
+        self._write_sheets(sheets, output, len(pages), progress)
+
+    def _page_source(self, pages):
+        """Pipeline stage 1: yield (page_index, page) in document order, across every input"""
+        yield from enumerate(pages)
+
+    def _compose_vector_sheets(self, pages):
+        """Pipeline stage 3 (vector): build one sheet per group of ``cards_per_sheet`` source pages
+
+        Identical source pages share one form XObject in the output.
+        """
+        pages_per_output = self.cards_per_sheet
+        digest_memo = {}
+        embedded = set()
+
+        for sheet_pages in _chunks(pages, pages_per_output):
+            xobjects = {}
+            operations = []
+            for layout_pos, (page_index, page) in enumerate(sheet_pages):
+                x, y = self._slot_position(layout_pos)
+                logger.debug("Layout %d: page %d at (%.1fmm, %.1fmm)", layout_pos + 1, page_index + 1, x / mm, y / mm)
+
+                name = NameObject(f"/Card{page_index}")
+                key = page_digest(page, digest_memo)
+                if key in embedded:
+                    xobjects[name] = SharedObject(key)
+                else:
+                    xobjects[name] = SharedObject(key, self._page_to_form_xobject(page))
+                    embedded.add(key)
+                operations.append(f"q {self._slot_matrix(page, layout_pos)} cm {name} Do Q")
+            yield self._vector_sheet(xobjects, operations)
+
+    def _page_to_form_xobject(self, page):
+        """Wrap a source page's content stream and resources in a form XObject
+
+        The page's visible annotations are flattened into it (see
+        _annotation_appearances()).
+        """
+        box = page.cropbox
+        contents = page['/Contents'] if '/Contents' in page else None
+        annotations = self._annotation_appearances(page)
+        if annotations:
+            form = self._flatten_annotations(page, contents, annotations)
+        elif isinstance(contents, ArrayObject):
+            content = DecodedStreamObject()
+            content.set_data(b'\n'.join(part.get_object().get_data() for part in contents))
+            form = content.flate_encode()
+        else:
+            # Reuse the encoded stream as-is; no need to decode and recompress it
+            form = contents.__class__() if contents is not None else DecodedStreamObject()
+            form._data = contents._data if contents is not None else b''
+            for key in ('/Filter', '/DecodeParms'):
+                if contents is not None and key in contents:
+                    form[NameObject(key)] = contents.raw_get(key)
+
+        form.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): ArrayObject([
+                FloatObject(box.left), FloatObject(box.bottom),
+                FloatObject(box.right), FloatObject(box.top),
+            ]),
+        })
+        if annotations:
+            return form
+        if '/Resources' in page:
+            # Keep the indirect reference so shared resources are written once
+            form[NameObject('/Resources')] = page.raw_get('/Resources')
+        return form
+
+    @staticmethod
+    def _annotation_appearances(page):
+        """(appearance stream, ``cm`` operands) for each annotation drawn on ``page``
+
+        An annotation is drawn from its normal appearance (/AP /N, or the /AS
+        state of it for check boxes and radio buttons), with the appearance's
+        box mapped onto the annotation's /Rect (PDF 32000-1, 12.5.5). One that
+        would be drawn but has no appearance stream makes the page unfit for
+        vector imposition: ValueError sends the job to the raster path, whose
+        renderer generates it. Every page is checked this way before a vector
+        job writes its first sheet.
+        """
+        if '/Annots' not in page:
+            return []
+        appearances = []
+        for annotation in page['/Annots'] or []:
+            annotation = annotation.get_object()
+            subtype = annotation.get('/Subtype')
+            if subtype in NON_DRAWING_ANNOTS or int(annotation.get('/F', 0)) & (ANNOT_HIDDEN | ANNOT_NO_VIEW):
+                continue
+            normal = annotation['/AP'].get_object().raw_get('/N') if '/AP' in annotation else None
+            if normal is None:
+                raise ValueError(f"{subtype} annotation without an appearance stream")
+            if not isinstance(normal.get_object(), StreamObject):
+                # Appearance states: only the current one (if any) is drawn
+                states = normal.get_object()
+                state = annotation.get('/AS')
+                if state is None or state not in states:
                     continue
-                with open(path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    for page in reader.pages:
-                        merger.add_page(page)
+                normal = states.raw_get(state)
+            stream = normal.get_object()
 
-            # Write merged PDF
-            with open(merged_path, 'wb') as out_f:
-                merger.write(out_f)
+            # The appearance's box, through its own /Matrix, is scaled and moved onto /Rect
+            a, b, c, d, e, f = [float(v) for v in stream.get('/Matrix', (1, 0, 0, 1, 0, 0))]
+            x0, y0, x1, y1 = [float(v) for v in stream['/BBox']]
+            corners = [(a * x + c * y + e, b * x + d * y + f) for x in (x0, x1) for y in (y0, y1)]
+            left, right = min(x for x, _ in corners), max(x for x, _ in corners)
+            bottom, top = min(y for _, y in corners), max(y for _, y in corners)
+            rect = [float(v) for v in annotation['/Rect']]
+            rect_left, rect_right = sorted(rect[0::2])
+            rect_bottom, rect_top = sorted(rect[1::2])
+            if right == left or top == bottom:
+                continue
+            scale_x = (rect_right - rect_left) / (right - left)
+            scale_y = (rect_top - rect_bottom) / (top - bottom)
+            matrix = (scale_x, 0, 0, scale_y, rect_left - left * scale_x, rect_bottom - bottom * scale_y)
+            appearances.append((normal, " ".join(f"{v:.4f}" for v in matrix)))
+        return appearances
 
-            # Process merged PDF using existing pipeline
-            self.process_pdf(merged_path, output_path)
+    @staticmethod
+    def _flatten_annotations(page, contents, annotations):
+        """A form XObject stream of the page's content followed by its annotations' appearances"""
+        data = page.get_contents().get_data() if contents is not None else b''
+        resources = DictionaryObject(page['/Resources'] if '/Resources' in page else {})
+        xobjects = DictionaryObject(resources['/XObject'] if '/XObject' in resources else {})
+        operations = [b'q', data, b'Q']
+        for index, (appearance, matrix) in enumerate(annotations):
+            name = f"/Annot{index}"
+            while name in xobjects:
+                name += "_"
+            xobjects[NameObject(name)] = appearance
+            operations.append(f"q {matrix} cm {name} Do Q".encode('ascii'))
+        resources[NameObject('/XObject')] = xobjects
 
-        finally:
-            # Cleanup merged temp file
+        content = DecodedStreamObject()
+        content.set_data(b'\n'.join(operations))
+        form = content.flate_encode()
+        form[NameObject('/Resources')] = resources
+        return form
+
+    def _slot_matrix(self, page, layout_pos):
+        """The ``cm`` operands placing a source page in a slot"""
+        box = tuple(float(v) for v in page.cropbox)
+        rotation = int(page['/Rotate'] if '/Rotate' in page else 0) % 360
+        return _placement_matrix(box, rotation, self._slot_position(layout_pos),
+                                 (self.layout_width, self.layout_height))
+
+    def _vector_sheet(self, xobjects, operations):
+        """Build one sheet (200x300mm by default) that draws the given form XObjects"""
+        content = DecodedStreamObject()
+        content.set_data("\n".join(operations).encode('latin-1'))
+        return DictionaryObject({
+            NameObject('/Type'): NameObject('/Page'),
+            NameObject('/MediaBox'): ArrayObject([
+                FloatObject(0), FloatObject(0),
+                FloatObject(self.page_width), FloatObject(self.page_height),
+            ]),
+            NameObject('/Resources'): DictionaryObject({
+                NameObject('/XObject'): DictionaryObject(xobjects),
+            }),
+            NameObject('/Contents'): content.flate_encode(),
+        })
+
+    def _write_sheets(self, sheets, output, total_pages=0, progress=None):
+        """Pipeline sink: write each finished sheet before the next one is composed"""
+        with self._output_file(output) as output_file:
+            writer = IncrementalPdfWriter(output_file)
+            for sheet in sheets:
+                with self._timer.stage('save'):
+                    writer.add_page(sheet)
+                    # Hand the finished sheet on (to disk, or to a streaming response)
+                    output_file.flush()
+                logger.debug("Output page %d written", writer.page_count)
+                if progress is not None:
+                    progress(min(writer.page_count * self.cards_per_sheet, total_pages), total_pages)
+
+            with self._timer.stage('save'):
+                # An empty input still gets one blank sheet
+                if writer.page_count == 0:
+                    writer.add_page(self._vector_sheet({}, []))
+                writer.close()
+
+    def _process_pdf_raster(self, pages, output, progress=None):
+        """Render every card to an image and draw it on a ReportLab canvas"""
+        # Rendered pages land in a shared per-job directory (or, for input held in
+        # memory, come back over poppler's pipe, or from an in-process backend) and
+        # flow through the pipeline one window at a time, so memory doesn't grow
+        # with page count
+        backend = get_backend(self.render_backend) if self.render_backend is not None else None
+        with ExitStack() as stack:
+            if self.memory_budget is not None:
+                with self._timer.stage('admit'):
+                    stack.enter_context(self.memory_budget.reserve(self.raster_memory_estimate(len(pages))))
+            if backend is not None:
+                # e.g. the documents an in-process backend keeps open between ranges
+                stack.callback(backend.release, pages.sources)
+            render_dir = None
+            if backend is not None and backend.uses_files and any(isinstance(source, str) for source in pages.sources):
+                render_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='pdf_render_'))
+            cards = self._timer.iterate('render', self._render_stage(pages, self._page_source(pages), render_dir))
+            sheets = self._timer.iterate('draw', self._compose_raster_sheets(cards))
             try:
-                if 'merged_path' in locals() and os.path.exists(merged_path):
-                    os.remove(merged_path)
-            except Exception:
-                pass
+                self._write_sheets(sheets, output, len(pages), progress)
+            finally:
+                cards.close()
+
+        if self.raster_cache is not None:
+            stats = self.raster_cache.stats()
+            logger.info("Raster cache: hits=%d misses=%d evictions=%d", stats['hits'], stats['misses'], stats['evictions'])
+
+    def _render_stage(self, documents, pages, output_folder):
+        """Pipeline stage 2 (raster): yield (page_index, card, page_key) in page order
+
+        ``documents`` is the job's PageSequence and ``pages`` its page source.
+        Pages are rendered in ranges of one document with one backend call
+        each (for poppler, one spawn per range rather than per card). With
+        ``workers > 1`` the ranges are rendered and encoded in a process
+        pool, keeping at most two ranges per worker in flight; results are
+        still yielded in page order. Pages found in the raster cache, or
+        identical to an earlier page of the job, are not rendered at all.
+        """
+        # Digests of objects shared between pages, and of the pages seen so far
+        digest_memo = {}
+        seen = set()
+
+        # The first window is a single sheet, so the first sheet (and the first
+        # bytes of a streamed response) doesn't wait for a whole window to render
+        first_window = min(self.cards_per_sheet, self.raster_batch_pages)
 
-    def process_pdf(self, input_path, output_path):
-        """Process PDF and create A4 layout with 2x2 grid"""
+        if self.workers == 1:
+            for chunk in _chunks(pages, self.raster_batch_pages, first_window):
+                known, keys, runs = self._plan_chunk(documents, chunk, digest_memo, seen)
+                rendered = [(run, self._render_run(documents, run, output_folder)) for run in runs]
+                yield from self._assemble_chunk(chunk, known, keys, rendered)
+            return
+
+        # Split the job evenly across the workers, but never beyond one raster batch per task
+        chunk_pages = max(1, min(self.raster_batch_pages, -(-len(documents) // self.workers)))
+        max_in_flight = self.workers * 2
+
+        # Worker processes only start once something is submitted, so a fully cached job spawns none
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        in_flight = deque()
         try:
-            # Read input PDF
-            with open(input_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                total_pages = len(pdf_reader.pages)
-                print(f"Total pages in input PDF: {total_pages}")
-            
-            # Calculate number of output pages needed
-            pages_per_output = 4
-            output_pages_needed = (total_pages + pages_per_output - 1) // pages_per_output
-            print(f"Output pages needed: {output_pages_needed}")
-            
-            # Create output PDF using ReportLab Canvas with custom page size
-            custom_page_size = (self.page_width, self.page_height)
-            output_canvas = canvas.Canvas(output_path, pagesize=custom_page_size)
-            
-            page_index = 0
-            
-            for output_page in range(output_pages_needed):
-                # Create new page
-                if output_page > 0:
-                    output_canvas.showPage()
-                
-                # Calculate how many layouts to place on this page
-                layouts_on_this_page = min(pages_per_output, total_pages - (output_page * pages_per_output))
-                print(f"Output page {output_page + 1}: {layouts_on_this_page} layouts")
-                
-                # Place layouts in 2x2 grid
-                for layout_pos in range(layouts_on_this_page):
-                    if page_index >= total_pages:
-                        break
-                    
-                    # Calculate position in grid
-                    row = layout_pos // 2
-                    col = layout_pos % 2
-                    
-                    # Calculate absolute position on custom page
-                    x = self.start_x + col * self.layout_width
-                    y = self.start_y + (1 - row) * self.layout_height  # Flip Y coordinate
-                    
-                    print(f"  Layout {layout_pos + 1}: Page {page_index + 1} at ({x/mm:.1f}mm, {y/mm:.1f}mm)")
-                    
-                    # Place PDF page at this position
-                    self._place_pdf_page(output_canvas, input_path, page_index, x, y)
-                    
-                    page_index += 1
-            
-            output_canvas.save()
-                
-        except Exception as e:
-            print(f"Error in process_pdf: {e}")
-            # Fallback: create simple layout
-            self._create_fallback_layout(input_path, output_path)
+            for chunk in _chunks(pages, chunk_pages, min(first_window, chunk_pages)):
+                known, keys, runs = self._plan_chunk(documents, chunk, digest_memo, seen)
+                rendered = [(run, self._render_run(documents, run, output_folder, pool)) for run in runs]
+                in_flight.append((chunk, known, keys, rendered))
+                if len(in_flight) >= max_in_flight:
+                    yield from self._assemble_chunk(*in_flight.popleft())
+            while in_flight:
+                yield from self._assemble_chunk(*in_flight.popleft())
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _plan_chunk(self, documents, chunk, digest_memo, seen):
+        """Work out which pages of a chunk actually need rendering
+
+        Returns ``(known, keys, runs)``: cards that need no rendering (cache hits
+        and DUPLICATE_CARD for repeats of an earlier page), the page_digest() of
+        every page, and runs of ``(page_index, cache_key, target)`` to render,
+        each contiguous within one document and sharing one render target.
+        """
+        known = {}
+        keys = {}
+        runs = []
+        for page_index, page in chunk:
+            page_key = keys[page_index] = page_digest(page, digest_memo)
+            if page_key in seen:
+                known[page_index] = DUPLICATE_CARD
+                continue
+            seen.add(page_key)
+
+            target = self._render_target(page)
+            cache_key = None
+            if self.raster_cache is not None:
+                cache_key = self.raster_cache.key(page_key, self._render_settings(target))
+                card = self.raster_cache.get(cache_key)
+                if card is not None:
+                    known[page_index] = card
+                    continue
+            if (runs and runs[-1][-1][0] == page_index - 1 and runs[-1][-1][2] == target
+                    and documents.locate(page_index - 1)[0] == documents.locate(page_index)[0]):
+                runs[-1].append((page_index, cache_key, target))
+            else:
+                runs.append([(page_index, cache_key, target)])
+        return known, keys, runs
+
+    def _render_target(self, page):
+        """Pixel size that fills the slot at the profile's DPI, with the page scaled uniformly
+
+        Like vector imposition, a page whose orientation doesn't match the slot
+        is rendered as it is and turned a quarter afterwards.
+        """
+        # Backends render the media box, as displayed (after /Rotate)
+        box = page.mediabox
+        width, height = float(box.width), float(box.height)
+        if int(page['/Rotate'] if '/Rotate' in page else 0) % 180 == 90:
+            width, height = height, width
+
+        turn = (width > height) != (self.layout_width > self.layout_height)
+        slot_width, slot_height = self.layout_width, self.layout_height
+        if turn:
+            slot_width, slot_height = slot_height, slot_width
+        # Points to pixels: scale into the slot, then 72 points per inch at self.dpi
+        scale = min(slot_width / width, slot_height / height) * self.dpi / 72
+        return RenderTarget(max(1, round(width * scale)), max(1, round(height * scale)), turn)
+
+    def _render_settings(self, target):
+        """Everything besides the page itself that affects a rendered card"""
+        return (self.render_backend,) + tuple(target) + self._codec_args
+
+    def _render_run(self, documents, run, output_folder, pool=None):
+        """Render a contiguous run of pages, here or in the pool (returning a Future)"""
+        pdf_source, local_index = documents.source_of(run[0][0])
+        # poppler numbers pages from 1 within the run's own document
+        first_page, last_page = local_index + 1, local_index + len(run)
+        cache_keys = [key for _, key, _ in run]
+        target = run[0][2]
+        if pool is None:
+            thread_count = min(self.raster_threads, len(run))
+            return render_page_range(pdf_source, first_page, last_page, output_folder, thread_count, target,
+                                     *self._codec_args, self.raster_cache, cache_keys, self.render_gate,
+                                     self.render_backend)
+        return pool.submit(render_page_range, pdf_source, first_page, last_page, output_folder, 1, target,
+                           *self._codec_args, self.raster_cache, cache_keys, self.render_gate, self.render_backend)
+
+    def _assemble_chunk(self, chunk, known, keys, rendered):
+        """Yield a chunk's (page_index, card, page_key) triples in page order"""
+        cards = dict(known)
+        for run, result in rendered:
+            cards.update(self._collect_rendered(run, result))
+        for page_index, _ in chunk:
+            yield page_index, cards[page_index], keys[page_index]
+
+    def _collect_rendered(self, run, result):
+        """Wait for a render worker if needed and pair its cards with their page indices"""
+        if isinstance(result, Future):
+            try:
+                cards, encode_seconds = result.result()
+            except Exception as e:
+                logger.warning("Render worker failed for pages %d-%d: %s", run[0][0] + 1, run[-1][0] + 1, e)
+                cards, encode_seconds = [None] * len(run), 0.0
+            self._timer.add('encode', encode_seconds)
+        else:
+            # Rendered here, inside the render stage: move the encoding out of it
+            cards, encode_seconds = result
+            self._timer.add('render', -encode_seconds)
+            self._timer.add('encode', encode_seconds)
+        return zip((page_index for page_index, _, _ in run), cards)
+
+    def _compose_raster_sheets(self, cards):
+        """Pipeline stage 3 (raster): place each group of ``cards_per_sheet`` cards on a sheet
+
+        Every card is embedded as an XObject shared through the writer, so a
+        card that appears several times in a job (the same source page, or a
+        different page that rendered to the same pixels) is embedded once.
+        """
+        pages_per_output = self.cards_per_sheet
+        # page_key -> key of the shared XObject its card was embedded as, and each
+        # such key -> the pixel size of its card (None for placeholders)
+        embedded = {}
+        shared_keys = {}
+
+        for sheet_cards in _chunks(cards, pages_per_output):
+            xobjects = {}
+            operations = []
+            for layout_pos, (page_index, card, page_key) in enumerate(sheet_cards):
+                x, y = self._slot_position(layout_pos)
+                logger.debug("Layout %d: page %d at (%.1fmm, %.1fmm)", layout_pos + 1, page_index + 1, x / mm, y / mm)
+
+                name = NameObject(f"/Card{page_index}")
+                xobjects[name], size = self._card_xobject(card, page_index, page_key, embedded, shared_keys)
+                width, height, x, y = self._fit_in_slot(size, x, y)
+                operations.append(f"q {width:.4f} 0 0 {height:.4f} {x:.4f} {y:.4f} cm {name} Do Q")
+            yield self._vector_sheet(xobjects, operations)
+
+    def _card_xobject(self, card, page_index, page_key, embedded, shared_keys):
+        """Return the XObject (drawn in a unit square) for one slot of a raster sheet, and its pixel size"""
+        if card is DUPLICATE_CARD:
+            if page_key in embedded:
+                logger.debug("Reusing card for page %d", page_index + 1)
+                shared_key = embedded[page_key]
+                return SharedObject(shared_key), shared_keys[shared_key]
+            # The earlier copy of this page failed to render
+            card = None
+        if card is None:
+            return self._canvas_card_xobject(card, page_index), None
+
+        if isinstance(card, EncodedCard):
+            shared_key = hashlib.sha256(card.data).hexdigest()
+            size = (card.width, card.height)
+        else:
+            shared_key = hashlib.sha256(card.tobytes()).hexdigest()
+            size = card.size
+        embedded[page_key] = shared_key
+        if shared_key in shared_keys:
+            logger.debug("Reusing identical raster for page %d", page_index + 1)
+            return SharedObject(shared_key), size
 
-    def _place_pdf_page(self, canvas, pdf_path, page_num, x, y):
-        """Place PDF page content on canvas at specified position"""
+        shared_keys[shared_key] = size
+        if isinstance(card, EncodedCard):
+            xobject = self._image_xobject(card)
+            logger.debug("Placed page %d", page_index + 1)
+        else:
+            xobject = self._canvas_card_xobject(card, page_index)
+        return SharedObject(shared_key, xobject), size
+
+    def _fit_in_slot(self, size, x, y):
+        """Return (width, height, x, y) of a card of ``size`` pixels scaled uniformly into the slot at (x, y)
+
+        Cards are rendered at the slot's own aspect ratio, so this only leaves a
+        margin for pages of another shape; placeholders (size None) fill the slot.
+        """
+        if size is None:
+            return self.layout_width, self.layout_height, x, y
+        scale = min(self.layout_width / size[0], self.layout_height / size[1])
+        width, height = size[0] * scale, size[1] * scale
+        return width, height, x + (self.layout_width - width) / 2, y + (self.layout_height - height) / 2
+
+    def _canvas_card_xobject(self, card, page_index):
+        """Draw a card (or its placeholder) with ReportLab and wrap it in a form XObject"""
+        from reportlab.pdfgen import canvas
+
+        card_buffer = io.BytesIO()
+        card_canvas = canvas.Canvas(card_buffer, pagesize=(self.layout_width, self.layout_height))
+        self._place_pdf_page(card_canvas, card, page_index, 0, 0)
+        card_canvas.showPage()
+        card_canvas.save()
+        card_buffer.seek(0)
+
+        form = self._page_to_form_xobject(PyPDF2.PdfReader(card_buffer).pages[0])
+        # Map the layout-sized form onto the unit square, like an image XObject
+        form[NameObject('/Matrix')] = ArrayObject([
+            FloatObject(1 / self.layout_width), FloatObject(0),
+            FloatObject(0), FloatObject(1 / self.layout_height),
+            FloatObject(0), FloatObject(0),
+        ])
+        return form
+
+    def _image_xobject(self, card):
+        """Wrap an encoded card's bytes in an image XObject without recompressing them"""
+        image = EncodedStreamObject()
+        image._data = card.data
+        image.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Image'),
+            NameObject('/Width'): NumberObject(card.width),
+            NameObject('/Height'): NumberObject(card.height),
+            NameObject('/ColorSpace'): NameObject(card.color_space),
+            NameObject('/BitsPerComponent'): NumberObject(card.bits_per_component),
+            NameObject('/Filter'): NameObject(card.filter),
+        })
+        return image
+
+    def _place_pdf_page(self, canvas, card, page_num, x, y):
+        """Place a rendered PDF page on canvas at specified position"""
         try:
-            # Read the PDF page
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                if page_num < len(pdf_reader.pages):
-                    page = pdf_reader.pages[page_num]
-                    
-                    # Create a temporary PDF with just this page
-                    temp_writer = PyPDF2.PdfWriter()
-                    temp_writer.add_page(page)
-                    
-                    # Save to temporary file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                        temp_writer.write(temp_file)
-                        temp_path = temp_file.name
-                    
-                    # Convert to image using pdf2image
-                    try:
-                        images = convert_from_path(temp_path, dpi=300, first_page=1, last_page=1)
-                        
-                        if images:
-                            # Get the first (and only) image
-                            img = images[0]
-                            
-                            # Convert PIL image to bytes
-                            img_buffer = io.BytesIO()
-                            img.save(img_buffer, format='PNG')
-                            img_buffer.seek(0)
-                            
-                            # Create ImageReader for ReportLab
-                            img_reader = ImageReader(img_buffer)
-                            
-                            # Draw the image on canvas
-                            canvas.saveState()
-                            canvas.translate(x, y)
-                            
-                            # Draw the actual PDF content as image with exact layout dimensions
-                            canvas.drawImage(img_reader, 0, 0, width=self.layout_width, height=self.layout_height)
-                            
-                            canvas.restoreState()
-                            print(f"    Successfully placed page {page_num + 1}")
-                        else:
-                            # Fallback: draw placeholder if image conversion fails
-                            self._draw_placeholder(canvas, x, y, page_num)
-                            
-                    except Exception as img_error:
-                        print(f"Image conversion error for page {page_num}: {img_error}")
-                        # Fallback: draw placeholder
-                        self._draw_placeholder(canvas, x, y, page_num)
-                    
-                    # Clean up temporary file
-                    if os.path.exists(temp_path):
-                        os.unlink(temp_path)
-                else:
-                    print(f"Page {page_num} not found in PDF")
-                    self._draw_error_placeholder(canvas, x, y, page_num)
-                
+            if card is None:
+                # Fallback: draw placeholder if image conversion failed
+                self._draw_placeholder(canvas, x, y, page_num)
+                return
+
+            # Create ImageReader for ReportLab straight from the decoded image
+            from reportlab.lib.utils import ImageReader
+            img_reader = ImageReader(card)
+
+            # Draw the image on canvas
+            canvas.saveState()
+            canvas.translate(x, y)
+
+            # Draw the actual PDF content as image with exact layout dimensions
+            canvas.drawImage(img_reader, 0, 0, width=self.layout_width, height=self.layout_height)
+
+            canvas.restoreState()
+            logger.debug("Placed page %d", page_num + 1)
+
         except Exception as e:
-            print(f"Error processing page {page_num}: {e}")
+            logger.warning("Error processing page %d: %s", page_num + 1, e)
             # Draw error placeholder
             self._draw_error_placeholder(canvas, x, y, page_num)
 
@@ -230,32 +1113,32 @@ class PDFProcessor:
         canvas.restoreState()
 
 
-    def _create_fallback_layout(self, input_path, output_path):
+    def _create_fallback_layout(self, sources, output):
         """Create a fallback layout when PDF processing fails"""
         try:
-            with open(input_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                total_pages = len(pdf_reader.pages)
-            
-            output_writer = PyPDF2.PdfWriter()
-            
-            # Add pages in groups of 4
-            for i in range(0, total_pages, 4):
-                for j in range(min(4, total_pages - i)):
-                    if i + j < total_pages:
-                        page = pdf_reader.pages[i + j]
-                        # Scale down the page
-                        page.scale_by(0.5)  # Scale to half size
-                        output_writer.add_page(page)
-            
-            with open(output_path, 'wb') as output_file:
-                output_writer.write(output_file)
+            with ExitStack() as stack:
+                pages = PageSequence(sources, stack)
+                total_pages = len(pages)
+
+                output_writer = PyPDF2.PdfWriter()
+
+                # Add pages in groups of 4
+                for i in range(0, total_pages, 4):
+                    for j in range(min(4, total_pages - i)):
+                        if i + j < total_pages:
+                            page = pages[i + j]
+                            # Scale down the page
+                            page.scale_by(0.5)  # Scale to half size
+                            output_writer.add_page(page)
+
+                with self._output_file(output) as output_file:
+                    output_writer.write(output_file)
                 
         except Exception as e:
-            print(f"Error in fallback layout: {e}")
+            logger.error("Fallback layout failed, writing a blank sheet: %s", e)
             # Create empty PDF
             output_writer = PyPDF2.PdfWriter()
             output_writer.add_blank_page(width=self.page_width, height=self.page_height)
-            with open(output_path, 'wb') as output_file:
+            with self._output_file(output) as output_file:
                 output_writer.write(output_file)
 
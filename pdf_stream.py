@@ -0,0 +1,304 @@
+"""
+Incremental PDF writer
+
+Writes each page and the objects it references to the output as soon as the
+page is added, so finished sheets don't accumulate in memory the way they do
+in ReportLab's canvas or PyPDF2's PdfWriter. The page tree, catalog, xref
+table and trailer are written by close().
+
+Pages can be PyPDF2 page dictionaries from any reader (including one-page
+PDFs rendered by ReportLab) or dictionaries built in memory. Objects that are
+shared between pages of the same source reader are written only once, and so
+is every SharedObject with the same key, whichever page it appears on.
+
+ChunkStream turns anything that writes to a file object into an iterator of
+chunks, so a PDF can be sent over HTTP while it is still being written.
+"""
+
+import io
+import queue
+import threading
+import weakref
+from array import array
+
+from PyPDF2.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+
+PDF_HEADER = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n"
+
+# Object numbers reserved for the document catalog and the page tree root
+CATALOG_OBJECT = 1
+PAGES_OBJECT = 2
+
+# close() writes the page tree's /Kids and the xref table this many entries at a time
+CLOSE_BATCH = 1024
+
+
+class SharedObject:
+    """An object written once per output and referenced wherever its key appears
+
+    Only the first SharedObject with a given key needs ``obj``; later ones can
+    pass None, so callers don't have to keep the object around to reuse it.
+    """
+
+    __slots__ = ('key', 'obj')
+
+    def __init__(self, key, obj=None):
+        self.key = key
+        self.obj = obj
+
+
+class IncrementalPdfWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.offset = 0
+        # Object number of every page, in order (kept compact for long jobs)
+        self.page_numbers = array('Q')
+
+        # Byte offset of every object, indexed by object number (kept compact for long jobs)
+        self._offsets = array('Q', [0] * (PAGES_OBJECT + 1))
+        self._next_object = PAGES_OBJECT + 1
+        # source pdf -> {(idnum, generation): object number in this output}; weak so
+        # per-sheet readers are dropped (and their ids never reused) once written
+        self._written = weakref.WeakKeyDictionary()
+        # SharedObject key -> object number in this output
+        self._shared = {}
+        self._pending = []
+        self._closed = False
+
+        self._write(PDF_HEADER)
+
+    @property
+    def page_count(self):
+        return len(self.page_numbers)
+
+    def add_page(self, page):
+        """Write a page dictionary and everything it references"""
+        if self._closed:
+            raise ValueError("writer is already closed")
+
+        page = page.get_object()
+        sheet = DictionaryObject()
+        for key, value in page.items():
+            if key == '/Parent':
+                continue
+            sheet[NameObject(key)] = self._translate(value)
+        sheet[NameObject('/Type')] = NameObject('/Page')
+        sheet[NameObject('/Parent')] = IndirectObject(PAGES_OBJECT, 0, None)
+
+        page_number = self._allocate()
+        self._write_object(page_number, sheet)
+        self._flush_pending()
+        self.page_numbers.append(page_number)
+        return page_number
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer"""
+        if self._closed:
+            return
+        self._closed = True
+
+        # Written piece by piece rather than as one ArrayObject of every page
+        self._offsets[PAGES_OBJECT] = self.offset
+        self._write(f"{PAGES_OBJECT} 0 obj\n<< /Type /Pages /Count {len(self.page_numbers)} /Kids [".encode('ascii'))
+        for start in range(0, len(self.page_numbers), CLOSE_BATCH):
+            batch = self.page_numbers[start:start + CLOSE_BATCH]
+            self._write("".join(f" {number} 0 R" for number in batch).encode('ascii'))
+        self._write(b" ] >>\nendobj\n")
+
+        catalog = DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(PAGES_OBJECT, 0, None),
+        })
+        self._write_object(CATALOG_OBJECT, catalog)
+
+        xref_offset = self.offset
+        size = self._next_object
+        self._write(f"xref\n0 {size}\n0000000000 65535 f \n".encode('ascii'))
+        for start in range(1, size, CLOSE_BATCH):
+            batch = self._offsets[start:min(start + CLOSE_BATCH, size)]
+            self._write("".join(f"{offset:010d} 00000 n \n" for offset in batch).encode('ascii'))
+
+        trailer = io.BytesIO()
+        trailer.write(b"trailer\n")
+        DictionaryObject({
+            NameObject('/Size'): NumberObject(size),
+            NameObject('/Root'): IndirectObject(CATALOG_OBJECT, 0, None),
+        }).write_to_stream(trailer, None)
+        trailer.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+        self._write(trailer.getvalue())
+
+    def _allocate(self):
+        number = self._next_object
+        self._next_object += 1
+        self._offsets.append(0)
+        return number
+
+    def _reference(self, indirect):
+        """Map an indirect reference from a source document to an output object"""
+        written = self._written.setdefault(indirect.pdf, {})
+        key = (indirect.idnum, indirect.generation)
+        number = written.get(key)
+        if number is None:
+            target = indirect.get_object()
+            # Never follow links back into a source page tree
+            if isinstance(target, DictionaryObject) and target.get('/Type') in ('/Page', '/Pages'):
+                return NullObject()
+            number = self._allocate()
+            written[key] = number
+            self._pending.append((number, target))
+        return IndirectObject(number, 0, None)
+
+    def _share(self, shared):
+        number = self._shared.get(shared.key)
+        if number is None:
+            if shared.obj is None:
+                raise KeyError(f"shared object {shared.key} has not been written yet")
+            number = self._allocate()
+            self._shared[shared.key] = number
+            self._pending.append((number, shared.obj))
+        return IndirectObject(number, 0, None)
+
+    def _translate(self, value):
+        """Copy a direct object, renumbering every reference it contains"""
+        if isinstance(value, SharedObject):
+            return self._share(value)
+        if isinstance(value, IndirectObject):
+            return self._reference(value)
+        if isinstance(value, StreamObject):
+            # Streams can only be written as indirect objects
+            number = self._allocate()
+            self._pending.append((number, value))
+            return IndirectObject(number, 0, None)
+        if isinstance(value, DictionaryObject):
+            return DictionaryObject({
+                NameObject(key): self._translate(item) for key, item in value.items()
+            })
+        if isinstance(value, ArrayObject):
+            return ArrayObject(self._translate(item) for item in value)
+        return value
+
+    def _flush_pending(self):
+        while self._pending:
+            number, obj = self._pending.pop()
+            if isinstance(obj, StreamObject):
+                stream = obj.__class__()
+                stream._data = obj._data
+                for key, item in obj.items():
+                    if key != '/Length':
+                        stream[NameObject(key)] = self._translate(item)
+                obj = stream
+            else:
+                obj = self._translate(obj)
+            self._write_object(number, obj)
+
+    def _write_object(self, number, obj):
+        buffer = io.BytesIO()
+        buffer.write(f"{number} 0 obj\n".encode('ascii'))
+        obj.write_to_stream(buffer, None)
+        buffer.write(b"\nendobj\n")
+        self._offsets[number] = self.offset
+        self._write(buffer.getvalue())
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.offset += len(data)
+
+
+class ChunkStream:
+    """A write-only file object whose contents are consumed as an iterator of chunks
+
+    A producer running on another thread writes to it and calls flush() at
+    natural boundaries (the layout pipeline flushes after every sheet); each
+    flush hands the bytes written since the last one to the consumer. The
+    queue between them is bounded, so a producer that gets too far ahead of a
+    slow consumer waits instead of buffering the whole document.
+
+    The stream can only be rewound while nothing has been flushed yet.
+    """
+
+    _END = object()
+
+    def __init__(self, max_chunks=8):
+        self._queue = queue.Queue(max_chunks)
+        self._buffer = bytearray()
+        self._position = 0
+        self._flushed = False
+        self._cancelled = threading.Event()
+
+    def run(self, target, *args):
+        """Call ``target(*args)`` on a new thread and yield what it writes to this stream"""
+        def produce():
+            try:
+                target(*args)
+            except BaseException as e:
+                self._finish(e)
+            else:
+                self._finish(None)
+
+        threading.Thread(target=produce, name='pdf-stream', daemon=True).start()
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is self._END:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk
+        finally:
+            # The consumer went away (e.g. the client disconnected): stop the producer
+            self._cancelled.set()
+
+    def write(self, data):
+        if self._cancelled.is_set():
+            raise BrokenPipeError("the stream's consumer has gone away")
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+            self._flushed = True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (offset, whence) != (0, io.SEEK_SET) or self._flushed:
+            raise io.UnsupportedOperation("a stream that has been sent can't be rewound")
+        self._buffer.clear()
+        self._position = 0
+        return 0
+
+    def truncate(self, size=None):
+        # Writes only ever append, so truncating at the current position is a no-op
+        if size is not None and size != self._position:
+            raise io.UnsupportedOperation("a stream that has been sent can't be truncated")
+        return self._position
+
+    def _finish(self, error):
+        try:
+            if error is None:
+                self.flush()
+        except BaseException as e:
+            error = e
+        self._put(self._END if error is None else error)
+
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        if item is not self._END and not isinstance(item, BaseException):
+            raise BrokenPipeError("the stream's consumer has gone away")
@@ -0,0 +1,217 @@
+"""
+Persistent raster cache
+
+Rendered cards are stored on disk under a key derived from everything that
+affects the rendered pixels: the page's content streams, its resources (fonts,
+images, nested form XObjects), its boxes and rotation, its annotations (form
+fields included), and the render settings.
+Re-uploads of the same card designs then skip poppler and the encoder entirely.
+
+The cache is shared by every process that points at the same directory; how
+entries are stored and evicted is disk_cache.DiskCache's business.
+
+Entries are plain data (a fixed header and the pixels; see ENTRY_HEADER), never
+anything that runs code when loaded, and the directory must belong to the user
+running the cache and be closed to everyone else (it is created 0700, and
+tightened if it is ours but open). engine.user_cache_dir() gives each user
+their own.
+"""
+
+import hashlib
+import logging
+import os
+import struct
+import zlib
+
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# Bump when the key derivation, the entry format or what a backend draws changes
+CACHE_VERSION = 4
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Entry layout: magic, kind, then for an image its mode (its pixels follow,
+# deflated), for an encoded card its filter (its data follows as-is); width,
+# height, color space and bits per component (encoded cards only)
+ENTRY_HEADER = struct.Struct('>4sc16sII16sB')
+ENTRY_MAGIC = b'CRD%d' % CACHE_VERSION
+IMAGE_ENTRY = b'I'
+ENCODED_ENTRY = b'E'
+# What an entry may hold; anything else is an unreadable entry
+IMAGE_MODES = ('RGB', 'L')
+ENCODED_FILTERS = ('/FlateDecode', '/DCTDecode')
+COLOR_SPACES = ('/DeviceRGB', '/DeviceGray')
+BITS_PER_COMPONENT = (1, 8)
+
+# What an annotation contributes to how its page renders: its appearance and placement,
+# and for form fields the value and style a renderer draws a missing appearance from
+ANNOTATION_KEYS = ('/Subtype', '/Rect', '/F', '/AP', '/AS')
+FIELD_KEYS = ('/FT', '/Ff', '/V', '/DA', '/Q', '/MK')
+
+
+def page_digest(page, memo):
+    """Hash everything on a page that affects how it renders
+
+    ``memo`` holds the digests of indirect objects, per document, for the
+    duration of a job, so resources shared by many pages (fonts, logos) are
+    hashed only once.
+    """
+    digest = hashlib.sha256()
+    for box in (page.mediabox, page.cropbox):
+        digest.update(repr([float(value) for value in box]).encode('ascii'))
+    digest.update(repr(int(page['/Rotate'] if '/Rotate' in page else 0)).encode('ascii'))
+    for key in ('/Contents', '/Resources'):
+        digest.update(key.encode('latin-1'))
+        if key in page:
+            _update_digest(digest, page.raw_get(key), memo)
+    for annotation in (page['/Annots'] or []) if '/Annots' in page else []:
+        annotation = annotation.get_object()
+        digest.update(b'/Annot')
+        for key in ANNOTATION_KEYS + FIELD_KEYS:
+            # Field attributes may be inherited from the parent field
+            owner = annotation
+            while key not in owner and key in FIELD_KEYS and '/Parent' in owner:
+                owner = owner['/Parent']
+            if key in owner:
+                digest.update(key.encode('latin-1'))
+                _update_digest(digest, owner.raw_get(key), memo)
+    return digest.hexdigest()
+
+
+def _update_digest(digest, obj, memo):
+    if isinstance(obj, IndirectObject):
+        # Per document, one int per object: a long job keeps an entry for every object it hashed
+        digests = memo.setdefault(id(obj.pdf), {})
+        key = obj.idnum << 16 | obj.generation
+        value = digests.get(key)
+        if value is None:
+            # Placeholder for reference cycles (e.g. annotations pointing back at their page)
+            digests[key] = f"cycle {obj.idnum} {obj.generation}".encode('ascii')
+            nested = hashlib.sha256()
+            _update_digest(nested, obj.get_object(), memo)
+            value = digests[key] = nested.digest()
+        digest.update(b'R' + value)
+    elif isinstance(obj, StreamObject):
+        digest.update(b'S')
+        _update_dictionary(digest, obj, memo, skip=('/Length',))
+        digest.update(len(obj._data).to_bytes(8, 'big'))
+        digest.update(obj._data)
+    elif isinstance(obj, DictionaryObject):
+        digest.update(b'D')
+        _update_dictionary(digest, obj, memo)
+    elif isinstance(obj, ArrayObject):
+        digest.update(b'A%d' % len(obj))
+        for item in obj:
+            _update_digest(digest, item, memo)
+    else:
+        digest.update(f"{type(obj).__name__}:{obj!r};".encode('utf-8', 'surrogatepass'))
+
+
+def _update_dictionary(digest, obj, memo, skip=()):
+    for key in sorted(obj.keys()):
+        # Never walk back up into the page tree
+        if key in skip or key == '/Parent':
+            continue
+        digest.update(key.encode('latin-1'))
+        _update_digest(digest, obj.raw_get(key), memo)
+
+
+def _dump_card(card):
+    """Serialize a rendered card (a PIL image or a pre-encoded card)"""
+    from PIL import Image
+    if isinstance(card, Image.Image):
+        # Raw pixels compress well and decode much faster than PNG
+        header = ENTRY_HEADER.pack(ENTRY_MAGIC, IMAGE_ENTRY, card.mode.encode('ascii'), card.width, card.height, b'', 8)
+        return header + zlib.compress(card.tobytes(), 1)
+    header = ENTRY_HEADER.pack(ENTRY_MAGIC, ENCODED_ENTRY, card.filter.encode('ascii'), card.width, card.height,
+                               card.color_space.encode('ascii'), card.bits_per_component)
+    return header + card.data
+
+
+def _load_card(data):
+    magic, kind, name, width, height, color_space, bits = ENTRY_HEADER.unpack_from(data)
+    if magic != ENTRY_MAGIC:
+        raise ValueError("not a raster cache entry of this version")
+    name = name.rstrip(b'\0').decode('ascii')
+    body = data[ENTRY_HEADER.size:]
+    if kind == IMAGE_ENTRY:
+        from PIL import Image
+        if name not in IMAGE_MODES:
+            raise ValueError(f"unexpected image mode {name!r}")
+        # Never inflate more than the image can hold
+        size = width * height * Image.getmodebands(name)
+        pixels = zlib.decompressobj().decompress(body, size)
+        if len(pixels) != size:
+            raise ValueError("truncated pixel data")
+        return Image.frombytes(name, (width, height), pixels)
+    if kind == ENCODED_ENTRY:
+        from pdf_processor import EncodedCard
+        color_space = color_space.rstrip(b'\0').decode('ascii')
+        if name not in ENCODED_FILTERS or color_space not in COLOR_SPACES or bits not in BITS_PER_COMPONENT:
+            raise ValueError(f"unexpected encoding {name} {color_space} {bits}")
+        return EncodedCard(name, width, height, color_space, body, bits)
+    raise ValueError(f"unknown entry kind {kind!r}")
+
+
+class RasterCache(DiskCache):
+    """Content-addressed on-disk cache of rendered cards
+
+    Instances are cheap and picklable, so render workers get their own copy;
+    the hit/miss counters are per instance.
+    """
+
+    name = 'Raster cache'
+    suffix = '.card'
+    private = True
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, page_key, settings):
+        """Cache key for a page (its page_digest()) rendered with the given settings (any repr-able value)"""
+        digest = hashlib.sha256(f"v{CACHE_VERSION} {settings!r}".encode('utf-8'))
+        digest.update(page_key.encode('ascii'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached card for a key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry:
+                card = _load_card(entry.read())
+            # Refresh the entry for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            # A corrupt entry (e.g. from an older format) is just a miss
+            logger.warning("Raster cache: dropping unreadable entry %s: %s", key[:12], e)
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return card
+
+    def put(self, key, card):
+        """Store a card; concurrent writers of the same key are harmless"""
+        data = _dump_card(card)
+        with self._temp_file(self._path(key)) as temp_path:
+            with open(temp_path, 'wb') as entry:
+                entry.write(data)
+        self._stored(len(data))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+        }
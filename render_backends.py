@@ -0,0 +1,215 @@
+"""
+Raster rendering backends
+
+A backend renders a range of pages of one PDF (a path, or the PDF itself as
+bytes) to images of an exact pixel size. Two are built in, in order of
+preference:
+
+    pdfium  - pypdfium2: renders in this process straight into a bitmap, from a
+              document that stays open for the following ranges of the same input
+    poppler - pdf2image: spawns pdftoppm per range and reads its images back
+              from files (or its output pipe)
+
+get_backend() hands out the process-wide instance of a backend, by default the
+first one installed. Which ones are installed is checked without importing
+them (poppler also needs pdftoppm on PATH), so importing this module is cheap. Backends are chosen by name, so render
+workers in other processes pick up their own instance.
+"""
+
+import importlib.util
+import logging
+import math
+import os
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('pdfium', 'poppler')
+
+# The module each backend needs
+BACKEND_MODULES = {
+    'pdfium': 'pypdfium2',
+    'poppler': 'pdf2image',
+}
+
+# The program each backend runs, if any
+BACKEND_PROGRAMS = {
+    'poppler': 'pdftoppm',
+}
+
+_lock = threading.Lock()
+_instances = {}
+
+
+def available_backends():
+    """Names of the installed backends, in order of preference"""
+    return tuple(name for name in BACKENDS if _installed(name))
+
+
+def _installed(name):
+    """Whether backend ``name``'s module is importable and its program, if it runs one, is on PATH"""
+    if importlib.util.find_spec(BACKEND_MODULES[name]) is None:
+        return False
+    program = BACKEND_PROGRAMS.get(name)
+    return program is None or shutil.which(program) is not None
+
+
+def default_backend():
+    """The backend used unless one is asked for, or None if none is installed"""
+    available = available_backends()
+    return available[0] if available else None
+
+
+def get_backend(name=None):
+    """The process-wide instance of backend ``name`` (None: the default)"""
+    name = name or default_backend()
+    if name is None:
+        raise RuntimeError("no raster backend installed (pip install pypdfium2, or pdf2image and poppler)")
+    with _lock:
+        backend = _instances.get(name)
+        if backend is None:
+            backend = _instances[name] = _BACKEND_CLASSES[name]()
+        return backend
+
+
+class RenderBackend:
+    """Interface of a rendering backend"""
+
+    name = None
+    # Whether render() makes use of more than one thread
+    threaded = False
+    # Whether render() writes its images to output_folder when it's given one
+    uses_files = False
+
+    def render(self, pdf_source, first_page, last_page, size=None, dpi=300, output_folder=None, thread_count=1):
+        """Render pages ``first_page`` to ``last_page`` (numbered from 1) of ``pdf_source``
+
+        Each page is rendered as displayed (after /Rotate) at exactly ``size``
+        (width, height) pixels, or at ``dpi`` if size is None. Returns one item
+        per page: a PIL image, or the path of an image file the backend wrote to
+        ``output_folder`` (which the caller deletes).
+        """
+        raise NotImplementedError
+
+    def release(self, sources):
+        """Let go of anything held for ``sources`` (paths or bytes) once their job is done"""
+
+
+class PopplerBackend(RenderBackend):
+    name = 'poppler'
+    threaded = True
+    uses_files = True
+
+    def render(self, pdf_source, first_page, last_page, size=None, dpi=300, output_folder=None, thread_count=1):
+        from pdf2image import convert_from_bytes, convert_from_path
+        convert = convert_from_bytes if isinstance(pdf_source, bytes) else convert_from_path
+        return convert(
+            pdf_source,
+            dpi=dpi,
+            size=size,
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=output_folder,
+            fmt='ppm',
+            thread_count=thread_count,
+            paths_only=output_folder is not None,
+        )
+
+
+class PdfiumBackend(RenderBackend):
+    """In-process rendering with pypdfium2
+
+    PDFium isn't thread-safe, so renders in one process take turns; render in
+    worker processes (PDFProcessor(workers=N)) to use several cores. Each
+    thread keeps the last document it opened, so the jobs on different threads
+    don't close each other's.
+    """
+
+    name = 'pdfium'
+
+    # Serializes every PDFium call in this process
+    _pdfium_lock = threading.Lock()
+
+    def __init__(self):
+        # This thread's last document (and what it was opened from), kept open for its next range
+        self._open_document = threading.local()
+
+    def render(self, pdf_source, first_page, last_page, size=None, dpi=300, output_folder=None, thread_count=1):
+        import pypdfium2
+        import pypdfium2.raw as pdfium_c
+
+        images = []
+        with self._pdfium_lock:
+            document = self._open(pdf_source)
+            for page_index in range(first_page - 1, last_page):
+                page = document[page_index]
+                try:
+                    # Like poppler, render the media box rather than the crop box
+                    page.set_cropbox(*page.get_mediabox())
+                    # Rounded up at a DPI, like pdftoppm
+                    width, height = size or (math.ceil(page.get_width() * dpi / 72), math.ceil(page.get_height() * dpi / 72))
+                    bitmap = pypdfium2.PdfBitmap.new_native(width, height, pdfium_c.FPDFBitmap_BGR, rev_byteorder=True)
+                    try:
+                        bitmap.fill_rect((255, 255, 255, 255), 0, 0, width, height)
+                        # Scaled to exactly width x height; /Rotate is applied by PDFium
+                        render_args = (bitmap, page, 0, 0, width, height, 0,
+                                       pdfium_c.FPDF_ANNOT | pdfium_c.FPDF_REVERSE_BYTE_ORDER)
+                        pdfium_c.FPDF_RenderPageBitmap(*render_args)
+                        if page.formenv:
+                            # Form fields, drawn by the form filler (with their values) on top
+                            pdfium_c.FPDF_FFLDraw(page.formenv, *render_args)
+                        # An RGB image is a copy, so the bitmap can go
+                        images.append(bitmap.to_pil())
+                    finally:
+                        bitmap.close()
+                finally:
+                    page.close()
+        return images
+
+    def release(self, sources):
+        with self._pdfium_lock:
+            source = getattr(self._open_document, 'source', None)
+            if source is not None and any(self._same_source(source, other) for other in sources):
+                self._close()
+
+    @staticmethod
+    def _same_source(key, pdf_source):
+        if isinstance(pdf_source, bytes):
+            # The same bytes object for every range of an in-memory job
+            return key is pdf_source
+        return isinstance(key, tuple) and key[0] == pdf_source
+
+    def _open(self, pdf_source):
+        """This thread's open document for ``pdf_source``, opening it if need be (under the lock)"""
+        if isinstance(pdf_source, bytes):
+            key = pdf_source
+        else:
+            # A file changed since it was opened is opened again
+            stat = os.stat(pdf_source)
+            key = (pdf_source, stat.st_mtime_ns, stat.st_size)
+        source = getattr(self._open_document, 'source', None)
+        if source is not None and (source is key if isinstance(key, bytes) else source == key):
+            return self._open_document.document
+
+        import pypdfium2
+        self._close()
+        document = pypdfium2.PdfDocument(pdf_source)
+        # Before any page is loaded, or form fields aren't drawn
+        document.init_forms()
+        logger.debug("pdfium: opened %s (%d pages)", key[0] if isinstance(key, tuple) else "an in-memory PDF", len(document))
+        self._open_document.source = key
+        self._open_document.document = document
+        return document
+
+    def _close(self):
+        document = getattr(self._open_document, 'document', None)
+        self._open_document.source = self._open_document.document = None
+        if document is not None:
+            document.close()
+
+
+_BACKEND_CLASSES = {
+    'pdfium': PdfiumBackend,
+    'poppler': PopplerBackend,
+}
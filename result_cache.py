@@ -0,0 +1,171 @@
+"""
+Result cache
+
+Finished outputs are stored on disk under a key derived from the uploaded
+bytes and every setting that affects the output, so uploading the same PDF
+again with the same settings is answered with the stored output instead of a
+new conversion.
+
+Like the raster cache, the directory can be shared by several processes and
+is evicted least recently used first (see disk_cache.DiskCache). Outputs are
+not removed when they are downloaded; ``expire`` removes those that have not
+been stored or reused for a retention period.
+
+Identical uploads that arrive while the first one is still being converted are
+coalesced: ``claim`` hands every later request the id of the job already
+producing that key. Claims are per process.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+import metrics
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# Bump when the key derivation changes, or when a change to the layout code
+# should stop old outputs from being served
+CACHE_VERSION = 2
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def _update_with_file(digest, path):
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+
+
+class ResultCache(DiskCache):
+    """Content-addressed on-disk cache of finished output PDFs"""
+
+    name = 'Result cache'
+    suffix = '.pdf'
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.expirations = 0
+        # key -> id of the job producing it in this process
+        self._claims = {}
+        self._lock = threading.Lock()
+
+    def key(self, inputs, settings):
+        """Cache key for ``inputs`` (PDFs as bytes or paths, in order) laid out with ``settings``
+
+        ``settings`` is any value with a stable repr (e.g. a sorted tuple of
+        PDFProcessor options).
+        """
+        digest = hashlib.sha256(f"v{CACHE_VERSION} {settings!r} {len(inputs)}".encode('utf-8'))
+        for source in inputs:
+            # Hash each input separately, so the boundaries between merged files count
+            part = hashlib.sha256()
+            if isinstance(source, (bytes, bytearray)):
+                part.update(source)
+            else:
+                _update_with_file(part, source)
+            digest.update(part.digest())
+        return digest.hexdigest()
+
+    def claim(self, key, job_id):
+        """Claim ``key`` for ``job_id``; return the id of the job that holds the claim
+
+        That is ``job_id`` itself unless another job of this process is already
+        producing the key, in which case the caller should wait for that job.
+        """
+        with self._lock:
+            owner = self._claims.setdefault(key, job_id)
+        if owner != job_id:
+            self.coalesced += 1
+            metrics.RESULT_CACHE_REQUESTS.inc(outcome='coalesced')
+        return owner
+
+    def release(self, key):
+        """Drop the claim on ``key`` once its job has stored the result (or failed)"""
+        with self._lock:
+            self._claims.pop(key, None)
+
+    def get(self, key):
+        """Return the path of the cached output for a key, or None"""
+        path = self._path(key)
+        try:
+            # Refresh the entry for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            metrics.RESULT_CACHE_REQUESTS.inc(outcome='miss')
+            return None
+        self.hits += 1
+        metrics.RESULT_CACHE_REQUESTS.inc(outcome='hit')
+        return path
+
+    def path(self, key):
+        """Path of a stored output, without counting a lookup; None if it's gone"""
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def put_file(self, key, source_path):
+        """Move a finished output file into the cache"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(source_path, path)
+        except OSError:
+            # Another filesystem: copy next to the entry first, so the rename stays atomic
+            with self._temp_file(path) as temp_path:
+                shutil.copyfile(source_path, temp_path)
+            os.remove(source_path)
+        self._stored_file(path)
+        return path
+
+    def put_bytes(self, key, data):
+        """Store a finished output held in memory"""
+        path = self._path(key)
+        with self._temp_file(path) as temp_path:
+            with open(temp_path, 'wb') as entry:
+                entry.write(data)
+        self._stored(len(data))
+        return path
+
+    def expire(self, max_age):
+        """Remove outputs not stored or reused in the last ``max_age`` seconds, and abandoned temp files"""
+        cutoff = time.time() - max_age
+        removed = 0
+        with self._file_lock():
+            for path in self._entry_paths(suffixes=('.pdf', '.tmp')):
+                try:
+                    expired = os.stat(path).st_mtime < cutoff
+                except FileNotFoundError:
+                    continue
+                if expired and self._remove(path):
+                    removed += 1
+        self.expirations += removed
+        if removed:
+            logger.info("Result cache: expired %d outputs", removed)
+        return removed
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def _stored_file(self, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        self._stored(size)
@@ -0,0 +1,108 @@
+"""
+Production server: a web app on gunicorn's pre-forking WSGI server
+
+``python app.py`` runs Flask's development server: one process, no limit on
+concurrent conversions. This starts a gunicorn master that imports the
+conversion engine's code once (engine.preload()) and then forks the worker
+processes, which share the loaded code instead of each importing it; each
+worker builds its processors with the app's settings on first use. Every worker
+answers requests on a pool of threads and converts on its own job threads; once
+it has MAX_IN_FLIGHT_JOBS conversions in flight it refuses new uploads with 429
+and Retry-After, so a burst of uploads can't start more poppler runs than the
+machine can finish.
+
+The app module itself is imported in each worker, after the fork: it starts its
+job and cleanup threads at import, and threads don't survive a fork.
+
+gunicorn runs on Unix only: pip install gunicorn
+
+Usage: python serve.py [--app app|setting_didieu] [--bind 0.0.0.0:5002]
+                       [--workers N] [--threads N] [--job-workers N]
+                       [--max-in-flight N] [--timeout SECONDS]
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import sys
+
+import engine
+
+try:
+    from gunicorn.app.base import BaseApplication
+    GUNICORN_AVAILABLE = True
+except ImportError:
+    BaseApplication = object
+    GUNICORN_AVAILABLE = False
+
+logger = logging.getLogger('serve')
+
+APPS = ('app', 'setting_didieu')
+
+
+class Server(BaseApplication):
+    """gunicorn application serving the Flask app of ``module``"""
+
+    def __init__(self, module, options):
+        self.module = module
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Runs in each worker, after the fork (preload_app is off)
+        return importlib.import_module(self.module).app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', choices=APPS, default='app', help='web app to serve')
+    parser.add_argument('--bind', default='0.0.0.0:5002', help='address to listen on')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='request threads per worker process')
+    parser.add_argument('--job-workers', type=int, default=None,
+                        help='conversion threads per worker process (app only; default: JOB_WORKERS or 2)')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='conversions in flight per worker process before uploads get 429 '
+                             '(default: MAX_IN_FLIGHT_JOBS, or the app\'s own default)')
+    parser.add_argument('--timeout', type=int, default=120, help='seconds before a silent worker is restarted')
+    args = parser.parse_args(argv)
+
+    if not GUNICORN_AVAILABLE:
+        print("gunicorn is not installed (pip install gunicorn); it runs on Unix only", file=sys.stderr)
+        return 1
+
+    logging.basicConfig(
+        level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+        format='%(asctime)s %(levelname)s %(name)s %(message)s',
+    )
+
+    # The apps read these when they're imported, in the workers
+    if args.job_workers is not None:
+        os.environ['JOB_WORKERS'] = str(args.job_workers)
+    if args.max_in_flight is not None:
+        os.environ['MAX_IN_FLIGHT_JOBS'] = str(args.max_in_flight)
+
+    # Before the fork, so the workers inherit the loaded code. Only the code: the
+    # app's processors need its raster cache and admission control, which each
+    # worker sets up for itself once the app is imported
+    engine.preload()
+    logger.info("Serving %s on %s: %d workers x %d threads", args.app, args.bind, args.workers, args.threads)
+
+    Server(args.app, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'preload_app': False,
+    }).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
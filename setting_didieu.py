@@ -5,50 +5,48 @@ Salembar Dieusi opat ID Card
 PDF Layout Converter untuk ID Card printing
 """
 
+import logging
 import os
 import sys
 import tempfile
+import threading
 import uuid
 import time
-import threading
-from io import BytesIO
-from flask import Flask, request, render_template_string, send_file, jsonify
-import PyPDF2
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from PIL import Image
-
-# Try to import pdf2image, install if not available
-try:
-    from pdf2image import convert_from_path
-    PDF2IMAGE_AVAILABLE = True
-except ImportError:
-    PDF2IMAGE_AVAILABLE = False
-    print("Warning: pdf2image not available. Install with: pip install pdf2image")
+from flask import Flask, Response, request, render_template_string, send_file, jsonify
+import engine
+import metrics
+from engine import RASTER_BACKEND
+from janitor import Janitor
+
+# LOG_LEVEL=DEBUG logs every card and sheet; the default logs one line per job
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s %(message)s',
+)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Global dictionary to store file cleanup tasks
-file_cleanup_tasks = {}
-
-def cleanup_file_delayed(file_path, delay=5):
-    """Clean up file after a delay to avoid Windows file locking issues"""
-    def cleanup():
-        time.sleep(delay)
-        try:
-            if os.path.exists(file_path):
-                os.unlink(file_path)
-                print(f"Cleaned up file: {file_path}")
-        except Exception as e:
-            print(f"Error cleaning up file {file_path}: {e}")
-    
-    thread = threading.Thread(target=cleanup)
-    thread.daemon = True
-    thread.start()
-    return thread
+# Rendered cards are reused across uploads (raster fallback only)
+RASTER_CACHE_FOLDER = engine.user_cache_dir('setting_didieu_raster_cache')
+
+# Outputs are deleted this long after their download starts (Windows keeps files
+# locked while they are being sent); outputs nobody downloads, and files left in
+# the temp dir by a run that crashed, after OUTPUT_MAX_AGE
+DOWNLOAD_CLEANUP_DELAY = 10
+OUTPUT_MAX_AGE = 60 * 60
+
+# Uploads are converted on the request thread; past this many at once they are
+# refused with 429 and Retry-After instead of piling up poppler runs. Renders
+# also share the machine's render slots with app.py (engine.render_gate()).
+MAX_IN_FLIGHT_JOBS = int(os.environ.get('MAX_IN_FLIGHT_JOBS', 4))
+RETRY_AFTER_SECONDS = 10
+conversion_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT_JOBS)
+
+# One thread deletes every file that is due, instead of a sleeping thread per file
+janitor = Janitor()
+janitor.rescan(tempfile.gettempdir(), ('*_output.pdf', '*_input.pdf'), OUTPUT_MAX_AGE)
 
 # HTML Template
 HTML_TEMPLATE = """
@@ -406,269 +404,6 @@ HTML_TEMPLATE = """
 </html>
 """
 
-class PDFProcessor:
-    def __init__(self):
-        # Source PDF dimensions (128mm x 96mm) - but we want output to be 96mm x 128mm
-        self.source_width = 128 * mm
-        self.source_height = 96 * mm
-        
-        # Output layout dimensions (96mm x 128mm each)
-        self.layout_width = 96 * mm
-        self.layout_height = 128 * mm
-        
-        # Custom page dimensions (200mm x 300mm portrait)
-        self.page_width = 200 * mm
-        self.page_height = 300 * mm
-        
-        # Calculate total area needed for 2x2 grid (no spacing, layouts touch each other)
-        self.total_width = self.layout_width * 2  # 2 columns
-        self.total_height = self.layout_height * 2  # 2 rows
-        
-        # Calculate center position on custom page
-        self.start_x = (self.page_width - self.total_width) / 2
-        self.start_y = (self.page_height - self.total_height) / 2
-        
-        # Scale factor to fit source PDF (128x96) into layout (96x128)
-        self.scale_x = self.layout_width / self.source_width  # 96/128 = 0.75
-        self.scale_y = self.layout_height / self.source_height  # 128/96 = 1.33
-        self.scale = min(self.scale_x, self.scale_y)  # Use 0.75 to maintain aspect ratio
-        
-        print(f"Page dimensions: {self.page_width/mm:.1f}mm x {self.page_height/mm:.1f}mm")
-        print(f"Layout dimensions: {self.layout_width/mm:.1f}mm x {self.layout_height/mm:.1f}mm")
-        print(f"Total grid area: {self.total_width/mm:.1f}mm x {self.total_height/mm:.1f}mm")
-        print(f"Start position: ({self.start_x/mm:.1f}mm, {self.start_y/mm:.1f}mm)")
-        print(f"Scale factor: {self.scale:.3f}")
-
-    def process_pdf(self, input_path, output_path):
-        """Process PDF and create custom page layout with 2x2 grid"""
-        try:
-            # Read input PDF
-            with open(input_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                total_pages = len(pdf_reader.pages)
-                print(f"Total pages in input PDF: {total_pages}")
-            
-            # Calculate number of output pages needed
-            pages_per_output = 4
-            output_pages_needed = (total_pages + pages_per_output - 1) // pages_per_output
-            print(f"Output pages needed: {output_pages_needed}")
-            
-            # Create output PDF using ReportLab Canvas with custom page size
-            custom_page_size = (self.page_width, self.page_height)
-            output_canvas = canvas.Canvas(output_path, pagesize=custom_page_size)
-            
-            page_index = 0
-            
-            for output_page in range(output_pages_needed):
-                # Create new page
-                if output_page > 0:
-                    output_canvas.showPage()
-                
-                # Calculate how many layouts to place on this page
-                layouts_on_this_page = min(pages_per_output, total_pages - (output_page * pages_per_output))
-                print(f"Output page {output_page + 1}: {layouts_on_this_page} layouts")
-                
-                # Place layouts in 2x2 grid
-                for layout_pos in range(layouts_on_this_page):
-                    if page_index >= total_pages:
-                        break
-                    
-                    # Calculate position in grid
-                    row = layout_pos // 2
-                    col = layout_pos % 2
-                    
-                    # Calculate absolute position on custom page
-                    x = self.start_x + col * self.layout_width
-                    y = self.start_y + (1 - row) * self.layout_height  # Flip Y coordinate
-                    
-                    print(f"  Layout {layout_pos + 1}: Page {page_index + 1} at ({x/mm:.1f}mm, {y/mm:.1f}mm)")
-                    
-                    # Place PDF page at this position
-                    self._place_pdf_page(output_canvas, input_path, page_index, x, y)
-                    
-                    page_index += 1
-            
-            output_canvas.save()
-                
-        except Exception as e:
-            print(f"Error in process_pdf: {e}")
-            # Fallback: create simple layout
-            self._create_fallback_layout(input_path, output_path)
-
-    def _place_pdf_page(self, canvas, pdf_path, page_num, x, y):
-        """Place PDF page content on canvas at specified position"""
-        try:
-            # Read the PDF page
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                if page_num < len(pdf_reader.pages):
-                    page = pdf_reader.pages[page_num]
-                    
-                    # Create a temporary PDF with just this page
-                    temp_writer = PyPDF2.PdfWriter()
-                    temp_writer.add_page(page)
-                    
-                    # Save to temporary file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                        temp_writer.write(temp_file)
-                        temp_path = temp_file.name
-                    
-                    # Convert to image using pdf2image if available
-                    if PDF2IMAGE_AVAILABLE:
-                        try:
-                            images = convert_from_path(temp_path, dpi=300, first_page=1, last_page=1)
-                            
-                            if images:
-                                # Get the first (and only) image
-                                img = images[0]
-                                
-                                # Convert PIL image to bytes
-                                img_buffer = BytesIO()
-                                img.save(img_buffer, format='PNG')
-                                img_buffer.seek(0)
-                                
-                                # Create ImageReader for ReportLab
-                                img_reader = ImageReader(img_buffer)
-                                
-                                # Draw the image on canvas
-                                canvas.saveState()
-                                canvas.translate(x, y)
-                                
-                                # Draw the actual PDF content as image with exact layout dimensions
-                                canvas.drawImage(img_reader, 0, 0, width=self.layout_width, height=self.layout_height)
-                                
-                                canvas.restoreState()
-                                print(f"    Successfully placed page {page_num + 1} (as image)")
-                            else:
-                                # Fallback: draw placeholder if image conversion fails
-                                self._draw_placeholder(canvas, x, y, page_num)
-                                
-                        except Exception as img_error:
-                            print(f"Image conversion error for page {page_num}: {img_error}")
-                            # Fallback: draw placeholder
-                            self._draw_placeholder(canvas, x, y, page_num)
-                    else:
-                        # If pdf2image not available, try to embed PDF directly
-                        try:
-                            self._embed_pdf_page(canvas, temp_path, x, y, page_num)
-                        except Exception as embed_error:
-                            print(f"PDF embedding error for page {page_num}: {embed_error}")
-                            # Final fallback: draw placeholder
-                            self._draw_placeholder(canvas, x, y, page_num)
-                    
-                    # Clean up temporary file
-                    if os.path.exists(temp_path):
-                        os.unlink(temp_path)
-                else:
-                    print(f"Page {page_num} not found in PDF")
-                    self._draw_error_placeholder(canvas, x, y, page_num)
-                
-        except Exception as e:
-            print(f"Error processing page {page_num}: {e}")
-            # Draw error placeholder
-            self._draw_error_placeholder(canvas, x, y, page_num)
-
-    def _embed_pdf_page(self, canvas, pdf_path, x, y, page_num):
-        """Try to embed PDF page directly without image conversion"""
-        try:
-            # Read the PDF page
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                page = pdf_reader.pages[0]  # First page of the single-page PDF
-                
-                # Get page dimensions
-                page_width = float(page.mediabox.width)
-                page_height = float(page.mediabox.height)
-                
-                # Calculate scale to fit in layout
-                scale_x = self.layout_width / page_width
-                scale_y = self.layout_height / page_height
-                scale = min(scale_x, scale_y)
-                
-                # Draw PDF content as a rectangle with page info
-                canvas.saveState()
-                canvas.translate(x, y)
-                canvas.scale(scale, scale)
-                
-                # Draw a border
-                canvas.setStrokeColorRGB(0.2, 0.2, 0.2)
-                canvas.setFillColorRGB(0.98, 0.98, 0.98)
-                canvas.rect(0, 0, page_width, page_height, fill=1, stroke=1)
-                
-                # Add page number and info
-                canvas.setFillColorRGB(0.1, 0.1, 0.1)
-                canvas.setFont("Helvetica-Bold", 14)
-                canvas.drawString(10, page_height - 25, f"Page {page_num + 1}")
-                
-                canvas.setFont("Helvetica", 10)
-                canvas.drawString(10, page_height - 45, f"Size: {page_width:.0f}x{page_height:.0f}")
-                canvas.drawString(10, page_height - 60, "PDF content embedded")
-                
-                canvas.restoreState()
-                print(f"    Successfully embedded page {page_num + 1} (as PDF)")
-                
-        except Exception as e:
-            print(f"Error embedding PDF page {page_num}: {e}")
-            raise e
-
-    def _draw_placeholder(self, canvas, x, y, page_num):
-        """Draw a placeholder rectangle for PDF content"""
-        canvas.saveState()
-        canvas.translate(x, y)
-        
-        # Draw a border to represent the PDF content with exact layout dimensions
-        canvas.setStrokeColorRGB(0.8, 0.8, 0.8)
-        canvas.setFillColorRGB(0.95, 0.95, 0.95)
-        canvas.rect(0, 0, self.layout_width, self.layout_height, fill=1, stroke=1)
-        
-        # Add page number text
-        canvas.setFillColorRGB(0.3, 0.3, 0.3)
-        canvas.setFont("Helvetica", 12)
-        canvas.drawString(10, self.layout_height - 20, f"Page {page_num + 1}")
-        
-        canvas.restoreState()
-
-    def _draw_error_placeholder(self, canvas, x, y, page_num):
-        """Draw an error placeholder"""
-        canvas.saveState()
-        canvas.translate(x, y)
-        canvas.setStrokeColorRGB(1, 0, 0)
-        canvas.setFillColorRGB(1, 0.8, 0.8)
-        canvas.rect(0, 0, self.layout_width, self.layout_height, fill=1, stroke=1)
-        canvas.setFillColorRGB(1, 0, 0)
-        canvas.setFont("Helvetica", 10)
-        canvas.drawString(10, self.layout_height - 15, f"Error: Page {page_num + 1}")
-        canvas.restoreState()
-
-    def _create_fallback_layout(self, input_path, output_path):
-        """Create a fallback layout when PDF processing fails"""
-        try:
-            with open(input_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                total_pages = len(pdf_reader.pages)
-            
-            output_writer = PyPDF2.PdfWriter()
-            
-            # Add pages in groups of 4
-            for i in range(0, total_pages, 4):
-                for j in range(min(4, total_pages - i)):
-                    if i + j < total_pages:
-                        page = pdf_reader.pages[i + j]
-                        # Scale down the page
-                        page.scale_by(0.5)  # Scale to half size
-                        output_writer.add_page(page)
-            
-            with open(output_path, 'wb') as output_file:
-                output_writer.write(output_file)
-                
-        except Exception as e:
-            print(f"Error in fallback layout: {e}")
-            # Create empty PDF
-            output_writer = PyPDF2.PdfWriter()
-            output_writer.add_blank_page(width=self.page_width, height=self.page_height)
-            with open(output_path, 'wb') as output_file:
-                output_writer.write(output_file)
-
 # Flask Routes
 @app.route('/')
 def index():
@@ -676,6 +411,18 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    if not conversion_slots.acquire(blocking=False):
+        metrics.REQUESTS_REJECTED.inc(endpoint='upload_file')
+        response = jsonify({'error': 'Server is busy, please try again later', 'retry_after': RETRY_AFTER_SECONDS})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response
+    try:
+        return convert_upload()
+    finally:
+        conversion_slots.release()
+
+def convert_upload():
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
@@ -701,12 +448,16 @@ def upload_file():
         file.save(input_path)
         
         # Process PDF
-        processor = PDFProcessor()
+        # Built once per process, on the first upload (or by preload at startup)
+        processor = engine.processor(raster_cache=engine.raster_cache(RASTER_CACHE_FOLDER),
+                                     render_gate=engine.render_gate(), memory_budget=engine.memory_budget())
         processor.process_pdf(input_path, output_path)
         
         # Clean up input file immediately
         if os.path.exists(input_path):
             os.unlink(input_path)
+        # In case it's never downloaded
+        janitor.schedule(output_path, OUTPUT_MAX_AGE)
         
         return jsonify({
             'success': True,
@@ -745,48 +496,58 @@ def download_file(file_id):
                 )
                 
                 # Schedule cleanup after download (Windows-safe)
-                cleanup_file_delayed(output_path, delay=10)
+                janitor.schedule(output_path, DOWNLOAD_CLEANUP_DELAY)
                 return response
                 
             except PermissionError as e:
                 if attempt < max_retries - 1:
-                    print(f"Permission error on attempt {attempt + 1}, retrying in 2 seconds...")
+                    logger.warning("Permission error on attempt %d, retrying in 2 seconds...", attempt + 1)
                     time.sleep(2)
                     continue
                 else:
-                    print(f"Permission error after {max_retries} attempts: {e}")
+                    logger.error("Permission error after %d attempts: %s", max_retries, e)
                     # Schedule cleanup anyway
-                    cleanup_file_delayed(output_path, delay=30)
+                    janitor.schedule(output_path, 30)
                     return jsonify({'error': 'File is being used by another process. Please try again in a few seconds.'}), 500
             except Exception as e:
-                print(f"Unexpected error during download: {e}")
-                cleanup_file_delayed(output_path, delay=10)
+                logger.error("Unexpected error during download: %s", e)
+                janitor.schedule(output_path, DOWNLOAD_CLEANUP_DELAY)
                 return jsonify({'error': f'Download failed: {str(e)}'}), 500
         
     except Exception as e:
-        print(f"Error in download_file: {e}")
-        cleanup_file_delayed(output_path, delay=10)
+        logger.error("Error in download_file: %s", e)
+        janitor.schedule(output_path, DOWNLOAD_CLEANUP_DELAY)
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Conversion metrics, and the janitor's pending deletions, in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     print("=" * 60)
     print("Setting Didieu - Single File Version")
     print("Salembar Dieusi opat ID Card")
     print("=" * 60)
-    print(f"PDF2Image available: {PDF2IMAGE_AVAILABLE}")
-    if not PDF2IMAGE_AVAILABLE:
-        print("⚠️  WARNING: PDF2Image not available!")
-        print("To enable full PDF processing:")
-        print("1. Install pdf2image: pip install pdf2image")
-        print("2. Install poppler:")
+    print(f"Raster backend: {RASTER_BACKEND or 'none'}")
+    if RASTER_BACKEND is None:
+        print("⚠️  WARNING: No raster backend available!")
+        print("Cards are still imposed as vector; the raster fallback is disabled.")
+        print("To enable the raster fallback, either:")
+        print("- Install pypdfium2: pip install pypdfium2")
+        print("- Or install pdf2image (pip install pdf2image) and poppler:")
         print("   Ubuntu/Debian: sudo apt-get install poppler-utils")
         print("   CentOS/RHEL: sudo yum install poppler-utils")
         print("   Windows: Download from https://github.com/oschwartz10612/poppler-windows/releases")
         print("   macOS: brew install poppler")
     else:
-        print("✅ PDF2Image is available - full PDF processing enabled")
+        print(f"✅ {RASTER_BACKEND} is available - raster fallback enabled")
     print("=" * 60)
-    print("Starting server...")
+    print(f"Files pending cleanup: {janitor.pending()}")
+    seconds = engine.preload(raster_cache=engine.raster_cache(RASTER_CACHE_FOLDER),
+                             render_gate=engine.render_gate(), memory_budget=engine.memory_budget())
+    print(f"Engine loaded in {seconds:.2f}s")
+    print("Starting server... (development server; use serve.py --app setting_didieu in production)")
     print("Access at: http://localhost:5002")
     print("=" * 60)
     
@@ -0,0 +1,37 @@
+"""
+Render slots are per user, and a gate that can't be held fails the job instead of blanking its cards
+"""
+
+import os
+import stat
+from contextlib import contextmanager
+
+import pytest
+
+import admission
+from benchmarks.corpus import generate_cards
+from pdf_processor import render_page_range
+from render_backends import available_backends
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason="POSIX only")
+def test_lock_directory_is_per_user_and_private(tmp_path):
+    assert os.path.basename(admission.DEFAULT_LOCK_DIR).endswith(f"-{os.getuid()}")
+    gate = admission.RenderGate(1, str(tmp_path / 'slots'))
+    with gate.hold() as granted:
+        assert granted == 1
+    assert stat.S_IMODE(os.stat(gate.directory).st_mode) == 0o700
+
+
+class _BrokenGate:
+    @contextmanager
+    def hold(self, wanted=1):
+        raise PermissionError("slot-0.lock")
+        yield wanted
+
+
+@pytest.mark.skipif(not available_backends(), reason="no raster backend installed")
+def test_gate_errors_are_not_turned_into_placeholders(tmp_path):
+    input_path = generate_cards(str(tmp_path / 'cards.pdf'), 2)
+    with pytest.raises(PermissionError):
+        render_page_range(input_path, 1, 2, str(tmp_path), render_gate=_BrokenGate())
@@ -0,0 +1,38 @@
+"""
+An output is only up to date if it was made from the current input with the current options
+"""
+
+import contextlib
+import io
+import os
+
+from batch_convert import OPTIONS_SUFFIX, is_up_to_date, main, output_path_for
+from benchmarks.corpus import generate_cards
+
+
+def _run(*argv):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert main(list(argv)) == 0
+    return output.getvalue()
+
+
+def test_outputs_are_redone_when_the_options_change(tmp_path):
+    input_path = generate_cards(str(tmp_path / 'cards.pdf'), 4)
+    output_path = output_path_for(input_path)
+    vector = {'render_mode': 'vector', 'quality': 'print', 'imposition': 'default',
+              'auto_pack': False, 'render_backend': None}
+
+    assert '0 up to date' in _run(str(tmp_path), '-j', '1', '--mode', 'vector')
+    assert is_up_to_date(input_path, output_path, vector)
+    assert not is_up_to_date(input_path, output_path, dict(vector, imposition='a4'))
+    assert '1 up to date' in _run(str(tmp_path), '-j', '1', '--mode', 'vector')
+    assert '0 up to date' in _run(str(tmp_path), '-j', '1', '--mode', 'vector', '--imposition', 'a4')
+
+    # Outputs from before options were recorded are converted again
+    os.remove(output_path + OPTIONS_SUFFIX)
+    assert not is_up_to_date(input_path, output_path, dict(vector, imposition='a4'))
+
+    # And, whatever their options, outputs older than their input
+    assert '0 up to date' in _run(str(tmp_path), '-j', '1', '--mode', 'vector')
+    os.utime(input_path, (os.path.getmtime(output_path) + 10,) * 2)
+    assert not is_up_to_date(input_path, output_path, vector)
@@ -0,0 +1,28 @@
+"""
+Both on-disk caches evict least recently used entries through the same code
+"""
+
+import os
+
+import pytest
+
+from raster_cache import RasterCache
+from result_cache import ResultCache
+
+
+@pytest.mark.parametrize('cache_class', [RasterCache, ResultCache])
+def test_least_recently_used_entries_are_evicted(tmp_path, cache_class):
+    cache = cache_class(str(tmp_path / 'cache'), max_bytes=10_000)
+    keys = [f'{n:02x}' * 32 for n in range(4)]
+    for age, key in enumerate(keys):
+        path = cache._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as entry:
+            entry.write(b'x' * 4000)
+        os.utime(path, (1000 + age,) * 2)
+    # A hit refreshes the oldest entry
+    os.utime(cache._path(keys[0]))
+
+    assert cache.evict() == 2
+    assert [os.path.exists(cache._path(key)) for key in keys] == [True, False, False, True]
+    assert cache.stats()['evictions'] == 2
@@ -0,0 +1,90 @@
+"""
+Filled form fields must survive conversion, whichever way the cards are drawn
+"""
+
+import contextlib
+import io
+
+import pytest
+from PIL import ImageStat
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, FloatObject, NameObject
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+from benchmarks.corpus import generate_cards
+from pdf_processor import PDFProcessor
+from render_backends import available_backends, get_backend
+
+# Where the text field sits on the 128x96mm card, in points
+FIELD = (20 * mm, 60 * mm, 80 * mm, 10 * mm)
+
+
+def _form(path, value):
+    """A one-card PDF with a text field holding ``value``"""
+    card = canvas.Canvas(str(path), pagesize=(128 * mm, 96 * mm))
+    x, y, width, height = FIELD
+    card.acroForm.textfield(name='name', value=value, x=x, y=y, width=width, height=height,
+                            borderWidth=0, fillColor=None, textColor=None, fontSize=14)
+    card.showPage()
+    card.save()
+    return str(path)
+
+
+def _field_darkness(image, page_height):
+    """Mean darkness (0-255) of the field's box in a render of the card"""
+    x, y, width, height = FIELD
+    scale = image.height / page_height
+    box = (x * scale, (page_height - y - height) * scale, (x + width) * scale, (page_height - y) * scale)
+    return 255 - ImageStat.Stat(image.convert('L').crop(tuple(round(v) for v in box))).mean[0]
+
+
+@pytest.mark.skipif('pdfium' not in available_backends(), reason="pypdfium2 is not installed")
+def test_pdfium_draws_filled_fields(tmp_path):
+    backend = get_backend('pdfium')
+    darkness = {}
+    for value in ('', 'JANE DOE FILLED'):
+        path = _form(tmp_path / f'form_{len(value)}.pdf', value)
+        try:
+            image, = backend.render(path, 1, 1, dpi=100)
+        finally:
+            backend.release([path])
+        darkness[value] = _field_darkness(image, 96 * mm)
+    assert darkness['JANE DOE FILLED'] > darkness[''] + 5, darkness
+
+
+def test_vector_mode_flattens_filled_fields(tmp_path):
+    input_path = _form(tmp_path / 'form.pdf', 'JANE DOE FILLED')
+    output_path = str(tmp_path / 'output.pdf')
+    with contextlib.redirect_stdout(io.StringIO()):
+        processor = PDFProcessor(render_mode='vector')
+        processor.process_pdf(input_path, output_path)
+    sheet = PdfReader(output_path).pages[0]
+    assert '/Annots' not in sheet
+    assert 'JANE DOE FILLED' in sheet.extract_text()
+
+
+@pytest.mark.skipif(not available_backends(), reason="no raster backend installed")
+def test_streamed_job_with_an_unflattenable_page_goes_raster_before_any_sheet(tmp_path):
+    # A square annotation with no appearance stream, on a page after the first sheets
+    writer = PdfWriter()
+    for page in PdfReader(generate_cards(str(tmp_path / 'cards.pdf'), 12)).pages:
+        writer.add_page(page)
+    square = DictionaryObject({
+        NameObject('/Type'): NameObject('/Annot'),
+        NameObject('/Subtype'): NameObject('/Square'),
+        NameObject('/Rect'): ArrayObject([FloatObject(v) for v in (20, 20, 120, 80)]),
+    })
+    writer.pages[10][NameObject('/Annots')] = ArrayObject([writer._add_object(square)])
+    input_path = str(tmp_path / 'annotated.pdf')
+    with open(input_path, 'wb') as file:
+        writer.write(file)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        processor = PDFProcessor()
+        output = b''.join(processor.stream_pdf(input_path))
+    sheets = PdfReader(io.BytesIO(output)).pages
+    assert len(sheets) == 3
+    # Every card was rendered: the whole job went raster, not just the pages after the annotation
+    assert all(xobject.get_object()['/Subtype'] == '/Image'
+               for sheet in sheets for xobject in sheet['/Resources']['/XObject'].values())
@@ -0,0 +1,26 @@
+"""
+The layout pipeline's memory must not grow with page count beyond a small per-page bound
+
+See benchmarks/bench_memory.py, which measures the same thing and prints the numbers.
+"""
+
+import pytest
+
+from benchmarks.bench_memory import NOISE_BYTES, PER_PAGE_BYTES, limit, measure
+from render_backends import available_backends
+
+
+@pytest.mark.parametrize('mode, page_counts', [
+    ('vector', [16, 1024]),
+    pytest.param('raster', [32, 96], marks=pytest.mark.skipif(not available_backends(),
+                                                             reason="no raster backend installed")),
+])
+def test_pipeline_memory_is_bounded_per_page(mode, page_counts):
+    (reference_pages, _, _, reference), *runs = measure(mode, page_counts)
+    for pages, _, _, overhead in runs:
+        bound = limit(reference_pages, reference, pages, PER_PAGE_BYTES[mode])
+        assert overhead <= bound, (
+            f"{mode}: {overhead // 1024} KiB of pipeline memory at {pages} pages, over the "
+            f"{bound // 1024:.0f} KiB allowed ({reference // 1024} KiB at {reference_pages} pages "
+            f"plus {NOISE_BYTES // 1024} KiB and {PER_PAGE_BYTES[mode]} bytes per page)"
+        )
@@ -0,0 +1,68 @@
+"""
+Raster cache entries are plain data, in a directory only its user can touch
+"""
+
+import os
+import pickle
+import stat
+
+import pytest
+from PIL import Image
+
+from pdf_processor import encode_card
+from raster_cache import RasterCache
+
+KEY = 'ab' * 32
+
+
+def _card(mode):
+    image = Image.new('RGB', (40, 30), 'white')
+    image.paste((200, 30, 30) if mode == 'color' else (128, 128, 128), (5, 5, 20, 20))
+    if mode == 'bilevel':
+        image.paste((0, 0, 0), (5, 5, 20, 20))
+    return image
+
+
+@pytest.mark.parametrize('codec', ['pil', 'flate', 'jpeg'])
+@pytest.mark.parametrize('mode', ['color', 'gray', 'bilevel'])
+def test_cards_round_trip(tmp_path, codec, mode):
+    cache = RasterCache(str(tmp_path / 'cache'))
+    card = encode_card(_card(mode), codec)
+    cache.put(KEY, card)
+    cached = cache.get(KEY)
+    if isinstance(card, Image.Image):
+        assert (cached.mode, cached.size, cached.tobytes()) == (card.mode, card.size, card.tobytes())
+    else:
+        assert cached == card
+
+
+class _Exploit:
+    def __reduce__(self):
+        return (os.mkdir, (self.path,))
+
+
+def test_pickled_entries_are_never_loaded(tmp_path):
+    cache = RasterCache(str(tmp_path / 'cache'))
+    exploit = _Exploit()
+    exploit.path = str(tmp_path / 'pwned')
+    path = cache._path(KEY)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as entry:
+        entry.write(pickle.dumps(exploit))
+
+    assert cache.get(KEY) is None
+    assert not os.path.exists(exploit.path)
+    assert not os.path.exists(path)
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason="POSIX permissions only")
+def test_directory_is_private(tmp_path):
+    new = tmp_path / 'new'
+    RasterCache(str(new))
+    assert stat.S_IMODE(os.stat(new).st_mode) == 0o700
+
+    shared = tmp_path / 'shared'
+    shared.mkdir(mode=0o777)
+    os.chmod(shared, 0o777)
+    RasterCache(str(shared))
+    assert stat.S_IMODE(os.stat(shared).st_mode) == 0o700
@@ -0,0 +1,15 @@
+"""
+A backend only counts as installed if everything it runs is there
+"""
+
+import importlib.util
+
+import pytest
+
+import render_backends
+
+
+@pytest.mark.skipif(importlib.util.find_spec('pdf2image') is None, reason="pdf2image is not installed")
+def test_poppler_needs_pdftoppm_on_path(monkeypatch):
+    monkeypatch.setenv('PATH', '/tmp/pdftoppm-not-here')
+    assert 'poppler' not in render_backends.available_backends()